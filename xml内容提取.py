@@ -1,9 +1,92 @@
 import os
-import xml.etree.ElementTree as ET
 import tkinter as tk
 from tkinter import Tk, filedialog, messagebox, ttk
 import threading
-import csv
+from collections import deque
+
+import xml内容提取引擎 as xml_engine
+
+# 界面刷新间隔（毫秒），期间产生的日志和进度合并成一次更新
+FRAME_INTERVAL_MS = 100
+# 日志框最多保留的行数，更早的日志只保存在日志文件中
+LOG_MAX_LINES = 5000
+# 完整日志文件名，保存在所选文件夹中
+LOG_FILE_NAME = "xml_extraction_log.txt"
+
+
+class UIChannel:
+    """
+    工作线程到Tk主线程的界面更新通道
+
+    工作线程只把日志和进度写进缓冲区，不再为每条日志调用 root.after；
+    主线程按固定间隔取出缓冲区一次性更新界面。缓冲区只保留最近的 max_lines 条日志，
+    完整日志同时写入日志文件。
+
+    参数:
+        max_lines (int): 缓冲区最多保留的日志条数
+    """
+
+    def __init__(self, max_lines=LOG_MAX_LINES):
+        self.lock = threading.Lock()
+        self.lines = deque(maxlen=max_lines)
+        self.progress = None
+        self.status = None
+        self.log_file = None
+
+    def open_log(self, path):
+        with self.lock:
+            self.log_file = open(path, 'w', encoding='utf-8')
+
+    def close_log(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+    def log(self, text):
+        with self.lock:
+            self.lines.append(text)
+            if self.log_file is not None:
+                self.log_file.write(text)
+
+    def set_progress(self, value, status=None):
+        with self.lock:
+            self.progress = value
+            if status is not None:
+                self.status = status
+
+    def drain(self):
+        """取出上次以来的日志、最新进度和状态，没有更新的项为None"""
+        with self.lock:
+            text = "".join(self.lines) or None
+            self.lines.clear()
+            progress, status = self.progress, self.status
+            self.progress = self.status = None
+        return text, progress, status
+
+
+class TkListener(xml_engine.ExtractionListener):
+    """把提取引擎的事件写入界面更新通道"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def on_start(self, total):
+        if total:
+            self.channel.log(f"扫描完成，共找到 {total} 个XML文件\n")
+
+    def on_message(self, text):
+        self.channel.log(text + "\n")
+
+    def on_file(self, index, total, xml_file, row):
+        if xml_engine.ERROR_FIELD in row:
+            self.channel.log(f"处理文件 {xml_file} 时出错: {row[xml_engine.ERROR_FIELD]}\n")
+        else:
+            self.channel.log(f"\n处理文件: {os.path.basename(xml_file)}\n" + xml_engine.format_row(row))
+        self.channel.set_progress((index + 1) / total * 100, f"正在提取... {index + 1}/{total}")
+
+    def on_finish(self, output_file, count, preview_rows):
+        self.channel.log(xml_engine.format_summary(output_file, count, preview_rows))
 
 
 class XMLToExcelConverter:
@@ -11,6 +94,9 @@ class XMLToExcelConverter:
         self.root = root
         self.root.title("XML信息提取工具")
         self.root.geometry("800x600")
+        self.channel = UIChannel()
+        self.running = False
+        self.watch_stop = None
 
         # 创建界面组件
         self.create_widgets()
@@ -32,6 +118,15 @@ class XMLToExcelConverter:
         self.folder_label = ttk.Label(main_frame, text="未选择文件夹", wraplength=700)
         self.folder_label.pack(pady=5)
 
+        # 输出格式选择，只列出当前环境可用的格式
+        format_frame = ttk.Frame(main_frame)
+        format_frame.pack(pady=5)
+        ttk.Label(format_frame, text="输出格式:").pack(side="left")
+        self.format_var = tk.StringVar(value="csv")
+        self.format_box = ttk.Combobox(format_frame, textvariable=self.format_var, state="readonly", width=10,
+                                       values=xml_engine.available_formats())
+        self.format_box.pack(side="left", padx=5)
+
         # 进度条
         self.progress = ttk.Progressbar(main_frame, orient="horizontal", length=600, mode="determinate")
         self.progress.pack(pady=10, fill="x")
@@ -40,6 +135,10 @@ class XMLToExcelConverter:
         self.start_button = ttk.Button(main_frame, text="开始提取", command=self.start_extraction, state="disabled")
         self.start_button.pack(pady=10)
 
+        # 监视文件夹按钮：提取后继续监视，只重新提取变化的文件
+        self.watch_button = ttk.Button(main_frame, text="监视文件夹", command=self.toggle_watch, state="disabled")
+        self.watch_button.pack(pady=5)
+
         # 状态标签
         self.status_label = ttk.Label(main_frame, text="准备就绪")
         self.status_label.pack(pady=5)
@@ -77,203 +176,107 @@ class XMLToExcelConverter:
             self.folder_path = folder_path
             self.folder_label.config(text=folder_path)
             self.start_button.config(state="enabled")
+            self.watch_button.config(state="enabled")
             self.result_text.delete(1.0, tk.END)
             self.result_text.insert(tk.END, f"已选择文件夹: {folder_path}\n")
 
-    def start_extraction(self):
+    def start_extraction(self, watch=False):
+        # 同一时间只运行一个提取或监视任务，它们共用输出文件、缓存和日志
+        if self.running:
+            return
         self.start_button.config(state="disabled")
+        if not watch:
+            self.watch_button.config(state="disabled")
+        self.select_button.config(state="disabled")
+        self.format_box.config(state="disabled")
         self.status_label.config(text="正在提取...")
         self.progress["value"] = 0
         self.result_text.delete(1.0, tk.END)
+        self.running = True
+        self.poll_ui()
 
         # 在新线程中执行提取操作
-        thread = threading.Thread(target=self.extract_xml_data)
+        thread = threading.Thread(target=self.extract_xml_data, args=(self.format_var.get(), watch))
         thread.daemon = True
         thread.start()
 
-    def parse_xml_file(self, xml_file):
-        """解析XML文件，处理ANSI编码"""
-        try:
-            # 使用二进制读取并自动检测编码
-            with open(xml_file, 'rb') as f:
-                content = f.read()
-
-            # 尝试多种编码
-            encodings = ['gbk', 'gb2312', 'utf-8', 'latin-1']
-            for encoding in encodings:
-                try:
-                    xml_content = content.decode(encoding)
-                    # 移除BOM（如果有）
-                    if xml_content.startswith('\ufeff'):
-                        xml_content = xml_content[1:]
-                    # 解析XML
-                    return ET.fromstring(xml_content)
-                except (UnicodeDecodeError, ET.ParseError):
-                    continue
-
-            raise Exception("无法解析XML文件，所有编码尝试都失败")
-
-        except Exception as e:
-            raise Exception(f"解析XML文件失败: {str(e)}")
-
-    def extract_xml_data(self):
+    def toggle_watch(self):
+        if self.watch_stop is None:
+            if self.running:
+                return
+            self.watch_stop = threading.Event()
+            self.watch_button.config(text="停止监视")
+            self.start_extraction(watch=True)
+        else:
+            self.watch_stop.set()
+            self.watch_button.config(state="disabled")
+
+    def flush_ui(self):
+        """把通道中积累的日志和进度一次性更新到界面，日志框只保留最后 LOG_MAX_LINES 行"""
+        text, progress, status = self.channel.drain()
+        if text:
+            self.result_text.insert(tk.END, text)
+            lines = int(self.result_text.index("end-1c").split(".")[0])
+            if lines > LOG_MAX_LINES:
+                self.result_text.delete("1.0", f"{lines - LOG_MAX_LINES + 1}.0")
+        if progress is not None:
+            self.progress.config(value=progress)
+        if status is not None:
+            self.status_label.config(text=status)
+
+    def poll_ui(self):
+        self.flush_ui()
+        if self.running:
+            self.root.after(FRAME_INTERVAL_MS, self.poll_ui)
+
+    def extract_xml_data(self, output_format="csv", watch=False):
+        cache = None
         try:
-            # 收集所有XML文件
-            xml_files = []
-            for root_dir, _, files in os.walk(self.folder_path):
-                for file in files:
-                    if file.lower().endswith('.xml'):
-                        xml_files.append(os.path.join(root_dir, file))
-
-            if not xml_files:
-                self.root.after(0, lambda: messagebox.showwarning("警告", "未找到XML文件"))
-                self.root.after(0, self.reset_ui)
+            # 完整日志写入文件，日志框只显示最近的部分
+            log_path = os.path.join(self.folder_path, LOG_FILE_NAME)
+            try:
+                self.channel.open_log(log_path)
+                self.channel.log(f"完整日志保存在: {log_path}\n")
+            except OSError as e:
+                self.channel.log(f"无法创建日志文件，只显示最近的日志: {str(e)}\n")
+            # 上次提取后没有变化的文件直接使用缓存结果，缓存保存在本机的用户缓存目录中
+            try:
+                cache = xml_engine.ExtractionCache(xml_engine.default_cache_path(self.folder_path))
+            except Exception as e:
+                self.channel.log(f"无法打开缓存，将重新解析所有文件: {str(e)}\n")
+            # 文件较多时用多个进程并行解析，少量文件时引擎自动只用线程
+            if watch:
+                xml_engine.watch_folder(self.folder_path, listener=TkListener(self.channel),
+                                        processes=os.cpu_count() or 1, cache=cache, scan_workers=4,
+                                        stop_event=self.watch_stop, output_format=output_format)
                 return
-
-            total_files = len(xml_files)
-            data = []
-
-            self.root.after(0, lambda: self.result_text.insert(tk.END, f"找到 {total_files} 个XML文件\n"))
-
-            for i, xml_file in enumerate(xml_files):
-                try:
-                    file_name = os.path.basename(xml_file)
-                    self.root.after(0, lambda f=file_name: self.result_text.insert(tk.END, f"\n处理文件: {f}\n"))
-
-                    # 解析XML文件
-                    root = self.parse_xml_file(xml_file)
-
-                    # 获取文件夹名称
-                    folder_name = os.path.basename(os.path.dirname(xml_file))
-
-                    # 获取describe标签内容
-                    describe = ""
-                    describe_elem = root.find(".//describe")
-                    if describe_elem is not None and describe_elem.text:
-                        describe = describe_elem.text.strip()
-
-                    # 获取expage元素的name属性 - 修正提取逻辑
-                    expage_name = ""
-                    # 查找所有expage元素
-                    for elem in root.findall(".//expage"):
-                        if 'name' in elem.attrib:
-                            expage_name = elem.attrib['name']
-                            break  # 只取第一个找到的
-
-                    # 如果没找到，尝试直接获取根元素的name属性
-                    if not expage_name and 'name' in root.attrib:
-                        expage_name = root.attrib['name']
-
-                    # 获取.cpt文件名称
-                    cpt_files = set()
-
-                    # 查找所有包含.cpt的文本内容
-                    for elem in root.iter():
-                        if elem.text and '.cpt' in elem.text:
-                            text = elem.text.strip()
-                            # 处理路径中的.cpt文件
-                            if text.endswith('.cpt'):
-                                cpt_files.add(os.path.basename(text))  # 只取文件名
-                            elif '/' in text or '\\' in text:
-                                # 从路径中提取文件名
-                                parts = text.replace('\\', '/').split('/')
-                                for part in parts:
-                                    if part.endswith('.cpt'):
-                                        cpt_files.add(part)
-
-                    cpt_names = ", ".join(sorted(cpt_files)) if cpt_files else "无"
-
-                    # 添加到数据列表
-                    data.append({
-                        "文件夹": folder_name,
-                        "描述": describe,
-                        "Expage名称": expage_name,
-                        "CPT文件": cpt_names
-                    })
-
-                    # 在日志中显示处理结果
-                    self.root.after(0, lambda f=folder_name, d=describe, e=expage_name, c=cpt_names:
-                    self.result_text.insert(tk.END,
-                                            f"  文件夹: {f}\n"
-                                            f"  描述: {d}\n"
-                                            f"  Expage名称: {e}\n"
-                                            f"  CPT文件: {c}\n"
-                                            ))
-
-                    # 更新进度
-                    progress_value = (i + 1) / total_files * 100
-                    self.root.after(0, lambda v=progress_value: self.progress.config(value=v))
-
-                except Exception as e:
-                    error_msg = f"处理文件 {xml_file} 时出错: {str(e)}\n"
-                    self.root.after(0, lambda: self.result_text.insert(tk.END, error_msg))
-                    # 添加错误信息到数据中
-                    data.append({
-                        "文件夹": os.path.basename(os.path.dirname(xml_file)),
-                        "描述": "解析错误",
-                        "Expage名称": "无",
-                        "CPT文件": "无",
-                        "错误信息": str(e)
-                    })
-
-            # 保存为CSV文件
-            if data:
-                output_file = os.path.join(self.folder_path, "xml_extraction_result.csv")
-                try:
-                    # 使用UTF-8-BOM编码，确保Excel正确显示中文
-                    with open(output_file, 'w', newline='', encoding='utf-8-sig') as csvfile:
-                        fieldnames = ["文件夹", "描述", "Expage名称", "CPT文件"]
-                        if any("错误信息" in item for item in data):
-                            fieldnames.append("错误信息")
-
-                        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                        writer.writeheader()
-                        for row in data:
-                            # 确保所有值都是字符串
-                            safe_row = {}
-                            for key, value in row.items():
-                                if value is None:
-                                    safe_row[key] = ""
-                                else:
-                                    safe_row[key] = str(value)
-                            writer.writerow(safe_row)
-
-                    success_msg = f"\n✅ 提取完成！共处理 {len(data)} 个XML文件\n"
-                    success_msg += f"✅ 结果已保存到: {output_file}\n"
-                    success_msg += f"✅ 文件使用UTF-8-BOM编码，Excel可以正确显示中文\n"
-                    self.root.after(0, lambda: self.result_text.insert(tk.END, success_msg))
-
-                    # 显示数据预览
-                    self.root.after(0, lambda: self.result_text.insert(tk.END, "\n📊 数据预览 (前3行):\n"))
-                    for i, item in enumerate(data[:3]):
-                        preview = f"{i + 1}. 文件夹: {item['文件夹']}\n"
-                        preview += f"   描述: {item['描述']}\n"
-                        preview += f"   Expage名称: {item['Expage名称']}\n"
-                        preview += f"   CPT文件: {item['CPT文件']}\n"
-                        if "错误信息" in item:
-                            preview += f"   错误信息: {item['错误信息']}\n"
-                        self.root.after(0, lambda p=preview: self.result_text.insert(tk.END, p))
-
-                    # 滚动到最底部
-                    self.root.after(0, lambda: self.result_text.see(tk.END))
-
-                except Exception as e:
-                    error_msg = f"保存CSV文件时出错: {str(e)}\n"
-                    self.root.after(0, lambda: self.result_text.insert(tk.END, error_msg))
-
-            else:
-                self.root.after(0, lambda: self.result_text.insert(tk.END, "❌ 未提取到任何数据\n"))
+            count = xml_engine.run_extraction(self.folder_path, listener=TkListener(self.channel),
+                                              processes=os.cpu_count() or 1, cache=cache, scan_workers=4,
+                                              output_format=output_format)
+            if not count:
+                self.root.after(0, lambda: messagebox.showwarning("警告", "未找到XML文件"))
 
         except Exception as e:
             error_msg = f"提取过程中发生错误: {str(e)}\n"
-            self.root.after(0, lambda: self.result_text.insert(tk.END, error_msg))
+            self.channel.log(error_msg)
             self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
 
         finally:
+            if cache is not None:
+                cache.close()
+            self.channel.close_log()
             self.root.after(0, self.reset_ui)
 
     def reset_ui(self):
-        self.status_label.config(text="提取完成")
+        self.running = False
+        self.flush_ui()
+        # 滚动到最底部
+        self.result_text.see(tk.END)
+        self.status_label.config(text="已停止监视" if self.watch_stop is not None else "提取完成")
+        self.watch_stop = None
+        self.watch_button.config(text="监视文件夹", state="enabled")
+        self.select_button.config(state="enabled")
+        self.format_box.config(state="readonly")
         self.start_button.config(state="enabled")
 
 
@@ -0,0 +1,315 @@
+import os
+import sys
+import time
+import codecs
+import argparse
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import xml内容提取引擎 as engine
+
+XML_TEMPLATE = """{declaration}{lead}<expages name="根元素">
+  <describe> {describe} </describe>
+  <expage name="{expage}">
+    <item>reports/{folder}/明细.cpt</item>
+    <item>汇总.cpt</item>
+    <note>{padding}</note>
+  </expage>
+  <other>/reports/{folder}/图表.cpt</other>
+</expages>
+"""
+
+
+def make_xml(encoding, declared=None, bom=b"", ascii_only=False, padding=0, lead=0):
+    """
+    按指定编码生成一个测试XML文件的内容
+
+    参数:
+        encoding (str): 文件实际使用的编码
+        declared (str): XML声明中写的编码，为None时不写XML声明
+        bom (bytes): 写在开头的BOM
+        ascii_only (bool): 只使用ASCII字符
+        padding (int): 额外填充的字符数，用于模拟较大的报表
+        lead (int): 根元素前ASCII注释的长度，超过判断编码读取的字节数时非ASCII内容出现在后面
+    """
+    declaration = f'<?xml version="1.0" encoding="{declared}"?>\n' if declared else ""
+    comment = f"<!-- {'x' * lead} -->\n" if lead else ""
+    text = XML_TEMPLATE.format(declaration=declaration, lead=comment, describe="月度报表描述", expage="月报页面",
+                               folder="财务", padding="数据" * (padding // 2))
+    if ascii_only:
+        for chinese, english in ASCII_NAMES.items():
+            text = text.replace(chinese, english)
+    # utf-16 编码时 Python 自己会写BOM
+    return bom + text.encode(encoding)
+
+
+ASCII_NAMES = {"月度报表描述": "monthly report", "月报页面": "monthly", "财务": "finance", "明细": "detail",
+               "汇总": "summary", "图表": "chart", "数据": "xx", "根元素": "root"}
+
+EXPECTED_ROW = {"描述": "月度报表描述", "Expage名称": "月报页面",
+                "CPT文件": ", ".join(sorted(["明细.cpt", "汇总.cpt", "图表.cpt"]))}
+
+# 测试样本：名称 -> (make_xml 的参数, 期望结果)，期望结果为None表示应当返回解析错误
+CORPUS_VARIANTS = {
+    "gbk_declared": ({"encoding": "gbk", "declared": "GBK"}, EXPECTED_ROW),
+    "gb2312_declared": ({"encoding": "gb2312", "declared": "gb2312"}, EXPECTED_ROW),
+    "gbk_undeclared": ({"encoding": "gbk"}, EXPECTED_ROW),
+    "gbk_mislabeled_utf8": ({"encoding": "gbk", "declared": "UTF-8"}, EXPECTED_ROW),
+    "utf8_declared": ({"encoding": "utf-8", "declared": "UTF-8"}, EXPECTED_ROW),
+    "utf8_undeclared": ({"encoding": "utf-8"}, EXPECTED_ROW),
+    "utf8_bom": ({"encoding": "utf-8", "declared": "UTF-8", "bom": codecs.BOM_UTF8}, EXPECTED_ROW),
+    "utf8_bom_undeclared": ({"encoding": "utf-8", "bom": codecs.BOM_UTF8}, EXPECTED_ROW),
+    "gbk_late_undeclared": ({"encoding": "gbk", "lead": engine.READ_SIZE + 4096}, EXPECTED_ROW),
+    "gbk_late_mislabeled_utf8": ({"encoding": "gbk", "declared": "UTF-8", "lead": engine.READ_SIZE + 4096},
+                                 EXPECTED_ROW),
+    "utf8_late_undeclared": ({"encoding": "utf-8", "lead": engine.READ_SIZE + 4096}, EXPECTED_ROW),
+    "utf16_bom": ({"encoding": "utf-16", "declared": "UTF-16"}, EXPECTED_ROW),
+    "ascii_only": ({"encoding": "ascii", "ascii_only": True},
+                   {"描述": "monthly report", "Expage名称": "monthly", "CPT文件": "chart.cpt, detail.cpt, summary.cpt"}),
+    "malformed": ({"encoding": "gbk", "declared": "GBK"}, None),
+}
+
+
+def write_corpus(folder, copies=1, padding=0):
+    """
+    在 folder 下按样本名称分子文件夹生成各种编码的测试XML文件
+
+    参数:
+        folder (str): 输出文件夹
+        copies (int): 每种样本的份数，用于基准测试
+        padding (int): 每个文件额外填充的字符数
+
+    返回:
+        dict: {文件路径: 期望结果}
+    """
+    expected = {}
+    for name, (options, row) in CORPUS_VARIANTS.items():
+        content = make_xml(padding=padding, **options)
+        if row is None:
+            # 截断成不完整的XML
+            content = content[:len(content) // 2]
+        variant_dir = os.path.join(folder, name)
+        os.makedirs(variant_dir, exist_ok=True)
+        for i in range(copies):
+            path = os.path.join(variant_dir, f"{name}_{i}.xml")
+            with open(path, 'wb') as f:
+                f.write(content)
+            expected[path] = row
+    return expected
+
+
+def legacy_parse_xml_file(xml_file):
+    """原来的解析方式：依次用每种编码解码整个文件并重新解析，作为对比基准"""
+    with open(xml_file, 'rb') as f:
+        content = f.read()
+    for encoding in ['gbk', 'gb2312', 'utf-8', 'latin-1']:
+        try:
+            xml_content = content.decode(encoding)
+            if xml_content.startswith('\ufeff'):
+                xml_content = xml_content[1:]
+            return ET.fromstring(xml_content)
+        except (UnicodeDecodeError, ET.ParseError):
+            continue
+    raise Exception("无法解析XML文件，所有编码尝试都失败")
+
+
+def legacy_extract_file(xml_file):
+    return engine.extract_fields(legacy_parse_xml_file(xml_file), xml_file)
+
+
+def tree_extract_file(xml_file):
+    return engine.extract_fields(engine.parse_xml_file(xml_file), xml_file)
+
+
+# 参与比较的提取方式
+METHODS = {
+    "legacy": legacy_extract_file,
+    "tree": tree_extract_file,
+    "stream": engine.extract_file_streaming,
+    "auto": engine.extract_xml_file,
+}
+
+
+def matches(row, expected):
+    if expected is None:
+        return row is None
+    return row is not None and all(row[key] == value for key, value in expected.items())
+
+
+def check_corpus():
+    """
+    用各种编码的样本检查每种提取方式的结果是否正确
+
+    返回:
+        bool: 当前实现（tree 和 stream）是否全部正确
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        expected = write_corpus(folder)
+        print(f"{'样本':<26}" + "".join(f"{name:>8}" for name in METHODS))
+        ok = True
+        for path, row in expected.items():
+            marks = []
+            for name, extract in METHODS.items():
+                try:
+                    result = extract(path)
+                except Exception:
+                    result = None
+                passed = matches(result, row)
+                marks.append("✅" if passed else "❌")
+                if name != "legacy":
+                    ok = ok and passed
+            print(f"{os.path.basename(os.path.dirname(path)):<26}" + "".join(f"{mark:>7}" for mark in marks))
+    return ok
+
+
+def run_benchmark(copies=200, padding=2000, repeat=3):
+    """
+    在混合编码的文件夹上比较各提取方式的耗时
+
+    参数:
+        copies (int): 每种样本的份数
+        padding (int): 每个文件额外填充的中文字符数
+        repeat (int): 重复次数，取最快的一次
+
+    返回:
+        list: 每种方式的结果
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        files = list(write_corpus(folder, copies, padding))
+        size = sum(os.path.getsize(path) for path in files)
+        print(f"{len(files)} 个文件，共 {size / 1024 / 1024:.1f} MB")
+        print(f"{'方式':<8} {'耗时(s)':>8} {'文件/秒':>8} {'MB/秒':>7}")
+        for name, extract in METHODS.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                for path in files:
+                    try:
+                        extract(path)
+                    except Exception:
+                        pass
+                timings.append(time.perf_counter() - started)
+            elapsed = min(timings)
+            result = {"method": name, "files": len(files), "seconds": elapsed,
+                      "files_per_sec": len(files) / elapsed, "mb_per_sec": size / elapsed / 1024 / 1024}
+            results.append(result)
+            print(f"{name:<8} {elapsed:>9.2f} {result['files_per_sec']:>10.0f} {result['mb_per_sec']:>9.1f}")
+    return results
+
+
+def make_rows(count):
+    """逐行生成模拟的提取结果，不占用与行数成正比的内存，每50行有一行错误"""
+    for i in range(count):
+        row = {"文件夹": f"财务/dir{i % 100}", "描述": f"月度报表描述{i}", "Expage名称": f"月报页面{i}",
+               "CPT文件": f"明细{i}.cpt, 汇总{i}.cpt, 图表{i}.cpt"}
+        if i % 50 == 0:
+            row[engine.ERROR_FIELD] = "解析XML文件失败: no element found: line 1, column 11"
+        yield row
+
+
+def bench_format(output_format, rows, trace_memory=False):
+    """
+    把 rows 行模拟结果写成一种格式，测量耗时、峰值内存和文件大小
+
+    tracemalloc 只能看到Python的内存分配，pyarrow 的数据在它自己的内存池里，
+    因此峰值内存再加上内存池的最高占用；在单独的进程中运行，内存池的统计不受其他格式影响
+
+    参数:
+        output_format (str): 输出格式
+        rows (int): 行数
+        trace_memory (bool): 是否记录峰值内存
+
+    返回:
+        dict: 测试结果
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        output_file = os.path.join(folder, "result" + engine.OUTPUT_FORMATS[output_format][1])
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            engine.write_results(output_file, make_rows(rows), output_format)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        if trace_memory and engine.pa is not None:
+            peak += engine.pa.default_memory_pool().max_memory()
+        size = os.path.getsize(output_file)
+    return {"format": output_format, "rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed,
+            "peak_mb": peak / 1024 / 1024, "file_mb": size / 1024 / 1024}
+
+
+def run_format_benchmark(rows=200000, formats=None, repeat=3):
+    """
+    比较各输出格式写大量结果行的速度和峰值内存
+
+    tracemalloc 会明显拖慢Python代码，因此速度和峰值内存分开测量，每次都在新的子进程中运行
+
+    参数:
+        rows (int): 行数
+        formats (list): 要比较的格式，默认为当前环境可用的所有格式
+        repeat (int): 测速的重复次数，取最快的一次
+
+    返回:
+        list: 每种格式的结果
+    """
+    available = engine.available_formats()
+    formats = formats or available
+    results = []
+    print(f"写入 {rows} 行")
+    print(f"{'格式':<8} {'耗时(s)':>8} {'行/秒':>9} {'峰值内存(MB)':>10} {'文件(MB)':>8}")
+    for output_format in formats:
+        if output_format not in available:
+            print(f"{output_format:<8} 跳过: {engine.OUTPUT_FORMATS[output_format][2]}")
+            continue
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            memory = executor.submit(bench_format, output_format, rows, True).result()
+        timings = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                timings.append(executor.submit(bench_format, output_format, rows).result())
+        result = min(timings, key=lambda item: item["seconds"])
+        result["peak_mb"] = memory["peak_mb"]
+        results.append(result)
+        print(f"{output_format:<8} {result['seconds']:>9.2f} {result['rows_per_sec']:>11.0f} "
+              f"{result['peak_mb']:>14.1f} {result['file_mb']:>10.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="XML信息提取的编码样本检查和基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("check", help="检查各种编码样本的提取结果")
+
+    bench_parser = subparsers.add_parser("bench", help="在混合编码的文件夹上比较提取耗时")
+    bench_parser.add_argument("--copies", type=int, default=200, help="每种样本的份数")
+    bench_parser.add_argument("--padding", type=int, default=2000, help="每个文件额外填充的中文字符数")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="重复次数，取最快的一次")
+
+    corpus_parser = subparsers.add_parser("corpus", help="生成编码样本文件夹")
+    corpus_parser.add_argument("folder", help="输出文件夹")
+    corpus_parser.add_argument("--copies", type=int, default=1, help="每种样本的份数")
+    corpus_parser.add_argument("--padding", type=int, default=0, help="每个文件额外填充的中文字符数")
+
+    format_parser = subparsers.add_parser("format", help="比较各输出格式写大量结果行的速度和峰值内存")
+    format_parser.add_argument("--rows", type=int, default=200000, help="写入的行数")
+    format_parser.add_argument("--format", action="append", choices=list(engine.OUTPUT_FORMATS), dest="formats",
+                               help="要比较的格式，可以指定多次，默认为当前环境可用的所有格式")
+    format_parser.add_argument("--repeat", type=int, default=3, help="重复次数，取最快的一次")
+
+    args = parser.parse_args()
+
+    if args.command == "check":
+        sys.exit(0 if check_corpus() else 1)
+    elif args.command == "bench":
+        run_benchmark(args.copies, args.padding, args.repeat)
+    elif args.command == "format":
+        run_format_benchmark(args.rows, args.formats, args.repeat)
+    else:
+        print(f"已生成 {len(write_corpus(args.folder, args.copies, args.padding))} 个样本文件: {args.folder}")
@@ -0,0 +1,1512 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import codecs
+import queue
+import shutil
+import fnmatch
+import hashlib
+import sqlite3
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import xlsxwriter
+except ImportError:  # 输出XLSX优先使用 xlsxwriter，没有时使用 openpyxl
+    xlsxwriter = None
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 输出Parquet需要 pyarrow，未安装时不可用
+    pa = pq = None
+try:
+    # 监视模式优先使用 watchdog（Linux 上基于 inotify，Windows 上基于 ReadDirectoryChangesW）
+    from watchdog.observers import Observer
+except ImportError:  # 没有安装 watchdog 时监视模式改为定时轮询
+    Observer = None
+
+# 默认输出文件名，保存在所选文件夹中
+OUTPUT_FILE_NAME = "xml_extraction_result.csv"
+# 输出列，固定包含错误信息列（没有出错的行为空），边处理边写出时不必等到最后才确定表头
+ERROR_FIELD = "错误信息"
+FIELDNAMES = ["文件夹", "描述", "Expage名称", "CPT文件", ERROR_FIELD]
+# 每写出这么多行或经过这么多秒就把结果刷到磁盘，中断时已处理的结果不会丢失
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 2.0
+# 处理完成后在日志中预览的行数
+PREVIEW_ROWS = 3
+# Parquet 每个行组的行数
+PARQUET_ROW_GROUP_ROWS = 50000
+# Excel 每个工作表最多的行数（含表头），写满后换到新的工作表继续写
+XLSX_MAX_ROWS = 1048576
+DEFAULT_WORKERS = 4
+# 提取结果缓存默认保存在本机用户缓存目录下的这个子目录中，按文件夹路径区分；
+# 不放在所选文件夹里，因为它常在网络共享盘上，SQLite 的 WAL 模式在网络文件系统上不能正常工作
+CACHE_DIR_NAME = "xml_extraction"
+# 提取逻辑或结果格式变化时加1，旧缓存自动作废
+CACHE_VERSION = 1
+# 文件数少于此值时不启动进程池，进程启动和传输结果的开销比解析本身还大
+PROCESS_MIN_FILES = 200
+# 每个进程一次领取的文件数，太大时进度更新不均匀，太小时进程间通信开销大
+PROCESS_CHUNK_SIZE = 16
+# 默认只处理的文件
+DEFAULT_INCLUDE = ("*.xml",)
+# 扫描结果队列的容量，扫描比解析快时最多领先这么多个文件
+SCAN_QUEUE_SIZE = 1024
+# 并行扫描时每个线程最多预先扫描的目录数，已列出但还没遍历到的目录不会无限堆积
+SCAN_PREFETCH_PER_WORKER = 4
+# 已提交但还没按顺序取走结果的文件数上限
+EXTRACT_WINDOW = 256
+# 监视模式：最后一次变化后等待这么多秒没有新变化才开始处理，合并连续的保存操作
+DEFAULT_DEBOUNCE = 1.0
+# 监视模式：需要处理的 watchdog 事件类型
+WATCH_EVENT_TYPES = {"created", "modified", "deleted", "moved", "closed"}
+# 监视模式：没有 watchdog 时轮询的间隔秒数
+DEFAULT_POLL_INTERVAL = 5.0
+# 监视模式：输出文件被占用（如在Excel中打开）无法替换时的重试间隔秒数
+WRITE_RETRY_SECONDS = 10.0
+# 流式解析时每次读取的字节数，单个文件的内存占用与此相关而与文件大小无关
+READ_SIZE = 64 * 1024
+# 字节顺序标记及对应编码，按长度从长到短匹配
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+# XML声明中的编码
+XML_DECLARATION = re.compile(rb'^\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+# expat 自己能解码的编码，这些文件直接把bytes交给解析器；GBK等多字节编码要先解码成文本
+EXPAT_ENCODINGS = {'utf-8', 'utf-16', 'iso8859-1', 'ascii'}
+# 声明或判断出的编码和文件内容不符导致解码失败时依次改用的编码，最后用 latin-1 兜底（不会解码失败）
+FALLBACK_ENCODINGS = ('gbk', 'latin-1')
+
+
+def match_any(patterns, name, relpath):
+    """
+    判断文件或目录是否匹配任一通配符（不区分大小写）
+
+    含 / 的通配符匹配相对路径（如 "archive/*"），否则只匹配名称（如 "*.xml"）
+    """
+    name, relpath = name.lower(), relpath.lower()
+    return any(fnmatch.fnmatchcase(relpath if '/' in pattern else name, pattern.lower()) for pattern in patterns)
+
+
+class XMLFileScanner:
+    """
+    用 os.scandir 流式遍历文件夹，边扫描边逐个返回匹配的文件
+
+    遍历顺序与 os.walk 相同（先返回目录中的文件，再依次进入各子目录），不跟随目录的符号链接。
+    scan_workers 大于1时，即将遍历到的子目录提前提交给线程池扫描（最多 scan_workers * SCAN_PREFETCH_PER_WORKER 个），
+    网络共享盘上多个目录的读取可以同时进行，但返回顺序不变。
+    扫描过程中可以随时用 estimate() 估算总文件数。
+
+    参数:
+        folder_path (str): 要遍历的文件夹
+        include (iterable): 要处理的文件的通配符，默认为 *.xml
+        exclude (iterable): 要跳过的文件或目录的通配符，匹配的目录不再进入
+        scan_workers (int): 并行扫描目录的线程数
+        start_path (str): 从文件夹中的这个子目录开始遍历，通配符仍按相对 folder_path 的路径匹配
+    """
+
+    def __init__(self, folder_path, include=None, exclude=None, scan_workers=1, start_path=None):
+        self.folder_path = folder_path
+        self.start_path = start_path or folder_path
+        self.include = tuple(include or DEFAULT_INCLUDE)
+        self.exclude = tuple(exclude or ())
+        self.scan_workers = scan_workers
+        self.prefix_len = len(os.path.join(folder_path, ""))
+        self.files_found = 0
+        self.dirs_scanned = 0
+        self.dirs_pending = 0
+        self.done = False
+
+    def scan_dir(self, path):
+        """列出一个目录，返回 (匹配的文件, 要进入的子目录)；无法读取的目录和 os.walk 一样跳过"""
+        files, dirs = [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    relpath = entry.path[self.prefix_len:].replace(os.sep, '/')
+                    if self.exclude and match_any(self.exclude, entry.name, relpath):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                dirs.append(entry.path)
+                        elif match_any(self.include, entry.name, relpath):
+                            files.append(entry)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return files, dirs
+
+    def accepts(self, path):
+        """判断文件夹中的一个文件是否会被遍历到：路径中的各级目录都没有被排除，且文件名匹配"""
+        relpath = os.path.relpath(path, self.folder_path).replace(os.sep, '/')
+        parts = relpath.split('/')
+        if self.exclude:
+            for i, name in enumerate(parts):
+                if match_any(self.exclude, name, '/'.join(parts[:i + 1])):
+                    return False
+        return not relpath.startswith('../') and match_any(self.include, parts[-1], relpath)
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.scan_workers) if self.scan_workers > 1 else None
+        prefetch = self.scan_workers * SCAN_PREFETCH_PER_WORKER
+        try:
+            # 栈中每项为 [目录, 预先扫描的 Future 或 None]，栈顶是下一个要遍历的目录
+            stack = [[self.start_path, None]]
+            submitted = 0
+            self.dirs_pending = 1
+            while stack:
+                if executor is not None:
+                    for item in islice(reversed(stack), prefetch):
+                        if submitted >= prefetch:
+                            break
+                        if item[1] is None:
+                            item[1] = executor.submit(self.scan_dir, item[0])
+                            submitted += 1
+                path, future = stack.pop()
+                if future is not None:
+                    submitted -= 1
+                    files, dirs = future.result()
+                else:
+                    files, dirs = self.scan_dir(path)
+                self.dirs_scanned += 1
+                self.dirs_pending += len(dirs) - 1
+                self.files_found += len(files)
+                yield from files
+                # 倒序入栈，保证先进入第一个子目录
+                stack.extend([path, None] for path in reversed(dirs))
+            self.done = True
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def estimate(self):
+        """估算总文件数：已找到的文件数加上尚未扫描的目录数乘以已扫描目录的平均文件数"""
+        if self.done or not self.dirs_scanned:
+            return self.files_found
+        return self.files_found + round(self.dirs_pending * self.files_found / self.dirs_scanned)
+
+
+def iter_in_background(iterable, maxsize=SCAN_QUEUE_SIZE):
+    """
+    在后台线程中迭代 iterable，通过有界队列逐个返回结果
+
+    扫描和解析同时进行：解析慢时队列满了扫描就暂停，内存占用有上限；
+    调用方提前结束迭代时后台线程也随之停止
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((True, finished))
+        except BaseException as e:
+            put((False, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            ok, item = items.get()
+            if not ok:
+                raise item
+            if item is finished:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def find_xml_files(folder_path, include=None, exclude=None):
+    """
+    遍历文件夹，收集所有XML文件
+
+    供需要完整列表的调用方使用；提取流程直接迭代 XMLFileScanner，边扫描边处理
+
+    参数:
+        folder_path (str): 要遍历的文件夹
+        include (iterable): 要处理的文件的通配符，默认为 *.xml
+        exclude (iterable): 要跳过的文件或目录的通配符
+
+    返回:
+        list: XML文件路径
+    """
+    return [entry.path for entry in XMLFileScanner(folder_path, include, exclude)]
+
+
+def normalize_encoding(name):
+    """把编码名称规范化为 codecs 的名称，GB2312 按其超集 GBK 处理，未知编码返回None"""
+    try:
+        name = codecs.lookup(name).name
+    except LookupError:
+        return None
+    return 'gbk' if name == 'gb2312' else name
+
+
+def is_utf8(head):
+    """判断开头的字节是否是合法的UTF-8，末尾被截断的多字节字符不算错误"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_encoding(head):
+    """
+    根据文件开头的字节一次确定编码：先看BOM，再看XML声明，最后检查字节内容
+
+    没有声明或声明为UTF-8、但内容不是合法UTF-8的文件按GBK处理（Windows下ANSI编码保存的报表）。
+    head 只是文件开头时，后面仍可能出现非UTF-8的字节，此时不交给expat直接解析，
+    而是增量解码，遇到非法字节时抛出 UnicodeDecodeError 以便换编码重试
+
+    参数:
+        head (bytes): 文件开头的若干字节，不足 READ_SIZE 时视为整个文件
+
+    返回:
+        tuple: (编码, 是否可以直接把bytes交给expat解析)
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, True
+
+    match = XML_DECLARATION.match(head)
+    declared = normalize_encoding(match.group(1).decode('ascii')) if match else None
+    if declared in (None, 'utf-8', 'ascii'):
+        if head.isascii() or is_utf8(head):
+            return 'utf-8', len(head) < READ_SIZE
+        return 'gbk', False
+    return declared, declared in EXPAT_ENCODINGS
+
+
+def fallback_encodings(encoding):
+    """按顺序返回 encoding 解码失败后要尝试的编码"""
+    return [fallback for fallback in FALLBACK_ENCODINGS if fallback != encoding]
+
+
+def read_head(f):
+    """读取文件开头用于判断编码的字节"""
+    return f.read(READ_SIZE)
+
+
+def parse_xml_content(content):
+    """
+    把整个文件的字节解析成元素树，编码只判断一次
+
+    参数:
+        content (bytes): 文件的全部内容
+
+    返回:
+        Element: 根元素
+    """
+    encoding, native = detect_encoding(content[:READ_SIZE])
+    if native:
+        return ET.fromstring(content)
+    for candidate in [encoding] + fallback_encodings(encoding):
+        try:
+            xml_content = content.decode(candidate)
+            break
+        except UnicodeDecodeError:
+            continue
+    return ET.fromstring(xml_content)
+
+
+def parse_xml_file(xml_file):
+    """解析XML文件，处理ANSI编码"""
+    try:
+        # 使用二进制读取，根据BOM、XML声明和内容确定一次编码
+        with open(xml_file, 'rb') as f:
+            content = f.read()
+        return parse_xml_content(content)
+
+    except Exception as e:
+        raise Exception(f"解析XML文件失败: {str(e)}")
+
+
+def extract_fields(root, xml_file):
+    """
+    从解析好的XML中提取描述、Expage名称和引用的.cpt文件
+
+    参数:
+        root (Element): XML根元素
+        xml_file (str): XML文件路径，用于取所在文件夹名称
+
+    返回:
+        dict: 一行结果
+    """
+    # 获取文件夹名称
+    folder_name = os.path.basename(os.path.dirname(xml_file))
+
+    # 获取describe标签内容
+    describe = ""
+    describe_elem = root.find(".//describe")
+    if describe_elem is not None and describe_elem.text:
+        describe = describe_elem.text.strip()
+
+    # 获取expage元素的name属性
+    expage_name = ""
+    for elem in root.findall(".//expage"):
+        if 'name' in elem.attrib:
+            expage_name = elem.attrib['name']
+            break  # 只取第一个找到的
+
+    # 如果没找到，尝试直接获取根元素的name属性
+    if not expage_name and 'name' in root.attrib:
+        expage_name = root.attrib['name']
+
+    # 查找所有包含.cpt的文本内容
+    cpt_files = set()
+    for elem in root.iter():
+        if elem.text and '.cpt' in elem.text:
+            add_cpt_names(elem.text, cpt_files)
+
+    return {
+        "文件夹": folder_name,
+        "描述": describe,
+        "Expage名称": expage_name,
+        "CPT文件": ", ".join(sorted(cpt_files)) if cpt_files else "无"
+    }
+
+
+def add_cpt_names(text, cpt_files):
+    """从一段元素文本中找出引用的.cpt文件名，加入 cpt_files"""
+    text = text.strip()
+    # 处理路径中的.cpt文件
+    if text.endswith('.cpt'):
+        cpt_files.add(os.path.basename(text))  # 只取文件名
+    elif '/' in text or '\\' in text:
+        # 从路径中提取文件名
+        for part in text.replace('\\', '/').split('/'):
+            if part.endswith('.cpt'):
+                cpt_files.add(part)
+
+
+def iter_chunks(f, head, encoding=None):
+    """
+    从已读取的开头开始按块读取文件
+
+    参数:
+        f: 以二进制方式打开的文件
+        head (bytes): 已经读取的开头
+        encoding (str): 为None时直接返回bytes，否则增量解码为文本
+    """
+    decoder = codecs.getincrementaldecoder(encoding)() if encoding else None
+    data = head
+    while True:
+        if decoder is None:
+            if data:
+                yield data
+        else:
+            text = decoder.decode(data, final=not data)
+            if text:
+                yield text
+        if not data:
+            break
+        data = f.read(READ_SIZE)
+
+
+def scan_xml_stream(chunks, want_cpt=True):
+    """
+    用 XMLPullParser 单遍扫描XML，边解析边释放已处理完的元素
+
+    结果与 extract_fields 相同：describe 取第一个后代 describe 元素的文本，
+    Expage名称取第一个带 name 属性的后代 expage 元素，没有时取根元素的 name 属性，
+    .cpt 引用从所有元素的文本中查找。根元素结束后仍读到末尾，根元素后面有多余内容时
+    与完整解析一样报错；want_cpt 为False时找到描述和Expage名称后立即停止。
+
+    参数:
+        chunks (iterable): 解码后的文本块
+        want_cpt (bool): 是否查找.cpt引用
+
+    返回:
+        tuple: (描述, Expage名称, .cpt文件名集合)
+    """
+    parser = ET.XMLPullParser(("start", "end"))
+    stack = []
+    root = describe_elem = expage_name = None
+    describe = result = None
+    cpt_files = set()
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                else:
+                    if elem.tag == "describe" and describe_elem is None:
+                        describe_elem = elem
+                    if elem.tag == "expage" and expage_name is None and 'name' in elem.attrib:
+                        expage_name = elem.attrib['name']
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if elem is describe_elem:
+                describe = (elem.text or "").strip()
+            if want_cpt and elem.text and '.cpt' in elem.text:
+                add_cpt_names(elem.text, cpt_files)
+            if elem is root:
+                # 根元素结束，此时它已经没有子元素，继续读完剩下的内容只为检查格式
+                result = describe or "", expage_name or root.attrib.get('name', ""), cpt_files
+                continue
+            # 已处理完的元素从父元素中移除，父元素同时最多只保留一个子元素
+            elem.clear()
+            stack[-1].remove(elem)
+            if not want_cpt and describe is not None and expage_name is not None:
+                return describe, expage_name, cpt_files
+    parser.close()
+    if result is None:
+        raise ET.ParseError("XML文档不完整")
+    return result
+
+
+def extract_file_streaming(xml_file, want_cpt=True):
+    """
+    流式解析并提取一个XML文件，不读入整个文件、不构建完整的元素树
+
+    参数:
+        xml_file (str): XML文件路径
+        want_cpt (bool): 是否查找.cpt引用，为False时可以提前停止解析
+
+    返回:
+        dict: 一行结果，与 extract_fields 的格式相同
+    """
+    try:
+        with open(xml_file, 'rb') as f:
+            describe, expage_name, cpt_files = scan_xml_file(f, read_head(f), want_cpt)
+    except Exception as e:
+        raise Exception(f"解析XML文件失败: {str(e)}")
+
+    return make_row(xml_file, describe, expage_name, cpt_files)
+
+
+def scan_xml_file(f, head, want_cpt=True):
+    """
+    从已经读出开头 head 的文件 f 继续流式解析
+
+    参数:
+        f (file): 以二进制方式打开的XML文件
+        head (bytes): 已经读出的文件开头
+        want_cpt (bool): 是否查找.cpt引用
+
+    返回:
+        tuple: (描述, Expage名称, .cpt文件名集合)
+    """
+    encoding, native = detect_encoding(head)
+    try:
+        return scan_xml_stream(iter_chunks(f, head, None if native else encoding), want_cpt)
+    except UnicodeDecodeError:
+        # 编码与内容不符（如前面全是ASCII、后面才出现GBK字节），依次换编码重新解析
+        for candidate in fallback_encodings(encoding):
+            f.seek(0)
+            head = read_head(f)
+            try:
+                return scan_xml_stream(iter_chunks(f, head, candidate), want_cpt)
+            except UnicodeDecodeError:
+                continue
+        raise
+
+
+def make_row(xml_file, describe, expage_name, cpt_files):
+    """按输出列组装一行结果"""
+    return {
+        "文件夹": os.path.basename(os.path.dirname(xml_file)),
+        "描述": describe,
+        "Expage名称": expage_name,
+        "CPT文件": ", ".join(sorted(cpt_files)) if cpt_files else "无"
+    }
+
+
+def extract_xml_file(xml_file):
+    """
+    提取一个XML文件：读一次就能读完的小文件直接解析成元素树，更大的文件才流式解析
+
+    小文件构建元素树比逐个处理解析事件快，GBK文件也只需整体解码一次；
+    大文件流式解析，内存占用不随文件大小增长
+
+    参数:
+        xml_file (str): XML文件路径
+
+    返回:
+        dict: 一行结果
+    """
+    try:
+        with open(xml_file, 'rb') as f:
+            head = read_head(f)
+            if len(head) < READ_SIZE:
+                root = parse_xml_content(head)
+            else:
+                describe, expage_name, cpt_files = scan_xml_file(f, head)
+                return make_row(xml_file, describe, expage_name, cpt_files)
+    except Exception as e:
+        raise Exception(f"解析XML文件失败: {str(e)}")
+
+    return extract_fields(root, xml_file)
+
+
+def extract_file(xml_file):
+    """
+    解析并提取一个XML文件，出错时返回带错误信息的行而不是抛出异常
+
+    参数:
+        xml_file (str): XML文件路径
+
+    返回:
+        dict: 一行结果
+    """
+    try:
+        return extract_xml_file(xml_file)
+    except Exception as e:
+        return {
+            "文件夹": os.path.basename(os.path.dirname(xml_file)),
+            "描述": "解析错误",
+            "Expage名称": "无",
+            "CPT文件": "无",
+            ERROR_FIELD: str(e)
+        }
+
+
+def file_digest(xml_file):
+    """计算文件内容的哈希，用于判断修改时间变了但内容没变的文件"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(xml_file, 'rb') as f:
+        for data in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def extract_entry(xml_file, with_digest=False):
+    """extract_file 加上可选的内容哈希，供缓存使用"""
+    return extract_file(xml_file), file_digest(xml_file) if with_digest else None
+
+
+def extract_batch(xml_files, with_digest=False):
+    """解析一批文件，顶层函数，可以整批提交给进程池"""
+    return [extract_entry(xml_file, with_digest) for xml_file in xml_files]
+
+
+def default_cache_path(folder_path):
+    """
+    返回一个文件夹默认使用的缓存文件路径，位于本机的用户缓存目录下
+
+    Windows 下为 %LOCALAPPDATA%，其他系统为 $XDG_CACHE_HOME 或 ~/.cache；
+    文件名由文件夹名称和完整路径的哈希组成，不同文件夹互不影响
+
+    参数:
+        folder_path (str): 要提取的文件夹
+
+    返回:
+        str: 缓存数据库文件路径
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Local'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    cache_dir = os.path.join(base, CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    folder = os.path.normcase(os.path.abspath(folder_path))
+    key = hashlib.sha1(folder.encode('utf-8', 'surrogatepass')).hexdigest()[:16]
+    name = re.sub(r'[^\w.-]', '_', os.path.basename(folder.rstrip('\\/'))) or 'root'
+    return os.path.join(cache_dir, f"{name}-{key}.db")
+
+
+class ExtractionCache:
+    """
+    按文件路径、大小和修改时间缓存每个XML文件的提取结果，保存在SQLite中
+
+    大小和修改时间都没变的文件直接使用缓存；启用内容哈希时，
+    修改时间变了但内容没变的文件（如重新同步、复制过的）也使用缓存。
+
+    参数:
+        path (str): 缓存数据库文件路径
+        use_hash (bool): 是否记录并比较内容哈希
+    """
+
+    def __init__(self, path, use_hash=False):
+        self.path = path
+        self.use_hash = use_hash
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        version = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != CACHE_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS files")
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CACHE_VERSION),))
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                digest TEXT,
+                row TEXT,
+                extracted REAL
+            )
+        """)
+        self.conn.commit()
+        self.stats = {"hits": 0, "misses": 0, "pruned": 0}
+
+    def get(self, xml_file, stat):
+        """
+        查询一个文件的缓存结果
+
+        参数:
+            xml_file (str): 文件的绝对路径
+            stat (os.stat_result): 文件当前的状态
+
+        返回:
+            dict: 缓存的结果行，没有缓存或已过期时为None
+        """
+        cached = self.conn.execute("SELECT size, mtime_ns, digest, row FROM files WHERE path = ?",
+                                   (xml_file,)).fetchone()
+        if cached is not None:
+            size, mtime_ns, digest, row = cached
+            if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                self.stats["hits"] += 1
+                return json.loads(row)
+            if self.use_hash and digest and size == stat.st_size and file_digest(xml_file) == digest:
+                # 只是修改时间变了，更新记录后继续使用
+                self.conn.execute("UPDATE files SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, xml_file))
+                self.stats["hits"] += 1
+                return json.loads(row)
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, xml_file, stat, row, digest=None):
+        """写入一个文件的结果；出错的行不缓存（可能只是文件暂时被占用或网络盘读取失败），下次重新解析"""
+        if ERROR_FIELD in row:
+            return
+        self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                          (xml_file, stat.st_size, stat.st_mtime_ns, digest,
+                           json.dumps(row, ensure_ascii=False), time.time()))
+
+    def prune(self, folder_path, seen):
+        """
+        删除文件夹下已经不存在的文件的缓存
+
+        参数:
+            folder_path (str): 文件夹的绝对路径
+            seen (set): 本次遍历到的文件
+        """
+        prefix = os.path.join(folder_path, "")
+        deleted = [(path,) for (path,) in self.conn.execute(
+            "SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+            if path not in seen]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", deleted)
+        self.stats["pruned"] += len(deleted)
+
+    def delete(self, xml_file):
+        self.conn.execute("DELETE FROM files WHERE path = ?", (xml_file,))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class ResultWriter:
+    """
+    输出格式的基类：边处理边把结果行写入文件，列固定为 FIELDNAMES
+
+    每写 flush_rows 行或经过 flush_seconds 秒刷新一次，内存占用与行数无关。
+    子类实现 write_values / sync / finish 三个方法。
+
+    参数:
+        output_file (str): 输出文件路径
+        flush_rows (int): 刷新间隔行数
+        flush_seconds (float): 刷新间隔秒数，为None时只按行数刷新
+    """
+
+    def __init__(self, output_file, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.output_file = output_file
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.count = 0
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        self.closed = False
+
+    def write(self, row):
+        """
+        写入一行
+
+        返回:
+            bool: 本次是否刷新了
+        """
+        # 确保所有值都是字符串，缺少的列写空字符串
+        self.write_values(["" if row.get(key) is None else str(row[key]) for key in FIELDNAMES])
+        self.count += 1
+        self.unflushed += 1
+        if self.unflushed >= self.flush_rows or (
+                self.flush_seconds is not None and time.monotonic() - self.last_flush >= self.flush_seconds):
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        self.sync()
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flush()
+            self.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_values(self, values):
+        """写入按 FIELDNAMES 顺序排列的一行字符串"""
+        raise NotImplementedError
+
+    def sync(self):
+        """把已写入的行交给磁盘"""
+
+    def finish(self):
+        """写完最后的内容并关闭文件"""
+
+
+class CSVResultWriter(ResultWriter):
+    """使用UTF-8-BOM编码写CSV，确保Excel正确显示中文；每次刷新都同步到磁盘，中途中断时已写出的结果仍然保留"""
+
+    def __init__(self, output_file, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        super().__init__(output_file, flush_rows, flush_seconds)
+        self.file = open(output_file, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(FIELDNAMES)
+
+    def write_values(self, values):
+        self.writer.writerow(values)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def finish(self):
+        self.file.close()
+
+
+class JSONLResultWriter(ResultWriter):
+    """每行一个JSON对象（UTF-8，不带BOM），便于 grep、jq 等按行处理的工具；中途中断时已写出的行仍然完整"""
+
+    def __init__(self, output_file, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        super().__init__(output_file, flush_rows, flush_seconds)
+        self.file = open(output_file, 'w', encoding='utf-8', newline='\n')
+
+    def write_values(self, values):
+        self.file.write(json.dumps(dict(zip(FIELDNAMES, values)), ensure_ascii=False) + "\n")
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def finish(self):
+        self.file.close()
+
+
+class XLSXResultWriter(ResultWriter):
+    """
+    写真正的Excel工作簿
+
+    优先使用 xlsxwriter 的 constant_memory 模式（每行写完立即落到临时文件），
+    没有安装时使用 openpyxl 的 write_only 模式。xlsx 是zip包，关闭时才生成完整文件，
+    因此刷新只控制缓存提交的节奏，中途中断时不会留下可用的工作簿。
+    结果超过一个工作表的行数上限时，依次写到“提取结果2”“提取结果3”……，每个工作表都有表头。
+    """
+
+    def __init__(self, output_file, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        super().__init__(output_file, flush_rows, flush_seconds)
+        if xlsxwriter is not None:
+            # 结果是纯文本，不把以 = 开头的内容当公式、不把网址转成链接
+            self.workbook = xlsxwriter.Workbook(output_file, {
+                "constant_memory": True, "strings_to_formulas": False, "strings_to_urls": False})
+            self.header_format = self.workbook.add_format({"bold": True})
+        else:
+            self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheets = 0
+        self.add_sheet()
+
+    def add_sheet(self):
+        """新建一个工作表并写入表头"""
+        self.sheets += 1
+        name = "提取结果" if self.sheets == 1 else f"提取结果{self.sheets}"
+        if xlsxwriter is not None:
+            self.sheet = self.workbook.add_worksheet(name)
+            self.sheet.freeze_panes(1, 0)
+            self.sheet.write_row(0, 0, FIELDNAMES, self.header_format)
+        else:
+            self.sheet = self.workbook.create_sheet(name)
+            self.sheet.append(FIELDNAMES)
+        self.sheet_rows = 1
+
+    def write_values(self, values):
+        if self.sheet_rows >= XLSX_MAX_ROWS:
+            self.add_sheet()
+        if xlsxwriter is not None:
+            if self.sheet.write_row(self.sheet_rows, 0, values) == -1:
+                raise RuntimeError(f"无法写入工作表第 {self.sheet_rows + 1} 行")
+        else:
+            # openpyxl 会把以 = 开头的文本当作公式，逐个单元格指定为文本类型
+            cells = []
+            for value in values:
+                cell = openpyxl.cell.WriteOnlyCell(self.sheet, value=value)
+                cell.data_type = 's'
+                cells.append(cell)
+            self.sheet.append(cells)
+        self.sheet_rows += 1
+
+    def finish(self):
+        if xlsxwriter is not None:
+            self.workbook.close()
+        else:
+            self.workbook.save(self.output_file)
+
+
+class ParquetResultWriter(ResultWriter):
+    """
+    用 pyarrow 写Parquet，所有列都是字符串
+
+    结果先按列缓存在内存里，每 flush_rows 行写成一个行组（row group），
+    行组太小会降低压缩率和读取速度，因此默认的刷新行数比其他格式大，也不按时间刷新。
+    Parquet 的元数据写在文件末尾，中途中断时不会留下可用的文件。
+    """
+
+    def __init__(self, output_file, flush_rows=PARQUET_ROW_GROUP_ROWS, flush_seconds=None):
+        super().__init__(output_file, flush_rows, flush_seconds)
+        self.schema = pa.schema([(name, pa.string()) for name in FIELDNAMES])
+        self.writer = pq.ParquetWriter(output_file, self.schema, compression="zstd")
+        self.columns = [[] for _ in FIELDNAMES]
+
+    def write_values(self, values):
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def sync(self):
+        if self.columns[0]:
+            self.writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, pa.string()) for column in self.columns], schema=self.schema))
+            self.columns = [[] for _ in FIELDNAMES]
+
+    def finish(self):
+        self.writer.close()
+
+
+# 输出格式 -> (写入类, 文件扩展名, 缺少依赖时的提示)
+OUTPUT_FORMATS = {
+    "csv": (CSVResultWriter, ".csv", None),
+    "xlsx": (XLSXResultWriter, ".xlsx", "输出XLSX需要安装 xlsxwriter 或 openpyxl"),
+    "parquet": (ParquetResultWriter, ".parquet", "输出Parquet需要安装 pyarrow"),
+    "jsonl": (JSONLResultWriter, ".jsonl", None),
+}
+# 推断输出格式时额外认识的扩展名
+FORMAT_EXTENSIONS = {".ndjson": "jsonl", ".pq": "parquet"}
+
+
+def available_formats():
+    """返回当前环境可以使用的输出格式"""
+    missing = set()
+    if xlsxwriter is None and openpyxl is None:
+        missing.add("xlsx")
+    if pq is None:
+        missing.add("parquet")
+    return [name for name in OUTPUT_FORMATS if name not in missing]
+
+
+def infer_output_format(output_file):
+    """根据输出文件扩展名推断格式，无法识别时为 csv"""
+    extension = os.path.splitext(output_file)[1].lower()
+    for name, (_, format_extension, _) in OUTPUT_FORMATS.items():
+        if extension == format_extension:
+            return name
+    return FORMAT_EXTENSIONS.get(extension, "csv")
+
+
+def default_output_file(folder_path, output_format=None):
+    """所选文件夹下的默认输出文件，扩展名跟随输出格式"""
+    extension = OUTPUT_FORMATS[output_format or "csv"][1]
+    return os.path.join(folder_path, os.path.splitext(OUTPUT_FILE_NAME)[0] + extension)
+
+
+def open_result_writer(output_file, output_format=None):
+    """
+    按输出格式创建写入对象
+
+    参数:
+        output_file (str): 输出文件路径
+        output_format (str): OUTPUT_FORMATS 中的格式，为None时根据扩展名推断
+
+    返回:
+        ResultWriter: 写入对象
+    """
+    output_format = output_format or infer_output_format(output_file)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    writer_class, _, missing_hint = OUTPUT_FORMATS[output_format]
+    if output_format not in available_formats():
+        raise RuntimeError(missing_hint)
+    return writer_class(output_file)
+
+
+def write_results(output_file, rows, output_format=None):
+    """
+    把全部结果行保存到输出文件
+
+    参数:
+        output_file (str): 输出文件路径
+        rows (iterable): 结果行
+        output_format (str): 输出格式，为None时根据扩展名推断
+    """
+    with open_result_writer(output_file, output_format) as writer:
+        for row in rows:
+            writer.write(row)
+
+
+def format_row(row):
+    """把一行结果格式化为日志文本"""
+    text = (f"  文件夹: {row['文件夹']}\n"
+            f"  描述: {row['描述']}\n"
+            f"  Expage名称: {row['Expage名称']}\n"
+            f"  CPT文件: {row['CPT文件']}\n")
+    if ERROR_FIELD in row:
+        text += f"  错误信息: {row[ERROR_FIELD]}\n"
+    return text
+
+
+def format_summary(output_file, count, preview_rows):
+    """把处理结果和前几行数据预览格式化为日志文本"""
+    text = f"\n✅ 提取完成！共处理 {count} 个XML文件\n"
+    text += f"✅ 结果已保存到: {output_file}\n"
+    if infer_output_format(output_file) == "csv":
+        text += "✅ 文件使用UTF-8-BOM编码，Excel可以正确显示中文\n"
+    text += f"\n📊 数据预览 (前{PREVIEW_ROWS}行):\n"
+    for i, row in enumerate(preview_rows[:PREVIEW_ROWS]):
+        text += f"{i + 1}. " + format_row(row)[2:].replace("\n  ", "\n   ")
+    return text
+
+
+class ExtractionListener:
+    """
+    提取过程的事件回调，默认什么都不做
+
+    命令行和图形界面各自继承并实现需要的方法，引擎本身不依赖任何界面。
+    """
+
+    def on_start(self, total):
+        """遍历完成、总文件数确定后调用，此时可能已经处理了一部分文件"""
+
+    def on_message(self, text):
+        """其他需要告诉用户的信息，如缓存命中情况"""
+
+    def on_file(self, index, total, xml_file, row):
+        """
+        每处理完一个文件调用一次，index 从0开始，按文件顺序依次调用
+
+        遍历完成前 total 是根据已扫描目录估算的总数，之后是准确的总数
+        """
+
+    def on_finish(self, output_file, count, preview_rows):
+        """结果保存完成后调用，preview_rows 为最前面的 PREVIEW_ROWS 行"""
+
+
+class ConsoleListener(ExtractionListener):
+    """把处理日志打印到标准输出，用于命令行和批处理任务"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def on_start(self, total):
+        print(f"扫描完成，共找到 {total} 个XML文件")
+
+    def on_message(self, text):
+        print(text)
+
+    def on_file(self, index, total, xml_file, row):
+        if ERROR_FIELD in row:
+            print(f"处理文件 {xml_file} 时出错: {row[ERROR_FIELD]}")
+        elif self.verbose:
+            print(f"\n处理文件: {os.path.basename(xml_file)}\n" + format_row(row), end="")
+
+    def on_finish(self, output_file, count, preview_rows):
+        print(format_summary(output_file, count, preview_rows), end="")
+
+
+def extract_ordered(items, workers=DEFAULT_WORKERS, processes=0, with_digest=False, window=EXTRACT_WINDOW):
+    """
+    边接收文件边并行解析，按接收顺序逐个返回结果
+
+    解析和遍历元素是CPU密集的，线程受GIL限制只能用一个核；指定 processes 且文件数
+    不少于 PROCESS_MIN_FILES 时改用进程池，文件分批提交以减少进程间通信。
+    同时在处理中的文件不超过 window 个，输入可以是边扫描边产生的无限长序列。
+
+    参数:
+        items (iterable): (文件路径, 缓存的结果行, ...) 元组，有缓存结果的文件不再解析
+        workers (int): 不使用进程池时的并行线程数
+        processes (int): 进程数，为0时只用线程
+        with_digest (bool): 是否同时计算内容哈希
+        window (int): 已提交但还没返回的文件数上限
+
+    返回:
+        iterator: 与输入顺序一致的 (输入元组, 结果行, 内容哈希)，使用缓存或不计算哈希时哈希为None
+    """
+    items = iter(items)
+    # 先看输入是否足够多，文件少时启动进程池得不偿失
+    head = list(islice(items, PROCESS_MIN_FILES))
+    if processes > 1 and len(head) >= PROCESS_MIN_FILES:
+        executor = ProcessPoolExecutor(max_workers=processes)
+        batch_size = PROCESS_CHUNK_SIZE
+        window = max(window, processes * batch_size * 4)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        batch_size = 1
+
+    pending = deque()  # (输入元组, 所在批次, 批次中的序号)，使用缓存时批次为None
+    batch = {"files": [], "future": None}
+
+    def flush():
+        nonlocal batch
+        if batch["files"]:
+            batch["future"] = executor.submit(extract_batch, batch["files"], with_digest)
+            batch = {"files": [], "future": None}
+
+    def pop():
+        item, owner, index = pending.popleft()
+        if owner is None:
+            return item, item[1], None
+        if owner["future"] is None:
+            flush()
+        row, digest = owner["future"].result()[index]
+        return item, row, digest
+
+    with executor:
+        for item in chain(head, items):
+            if item[1] is not None:
+                pending.append((item, None, 0))
+            else:
+                pending.append((item, batch, len(batch["files"])))
+                batch["files"].append(item[0])
+                if len(batch["files"]) >= batch_size:
+                    flush()
+            while len(pending) > window:
+                yield pop()
+        flush()
+        while pending:
+            yield pop()
+
+
+def lookup_cache(entries, cache, seen=None):
+    """
+    逐个查缓存，只有没缓存或已变化的文件才需要解析
+
+    参数:
+        entries (iterable): os.DirEntry 或文件路径
+        cache (ExtractionCache): 提取结果缓存，为None时不查
+        seen (set): 把查过的文件的绝对路径加入这个集合
+
+    返回:
+        iterator: 供 extract_ordered 使用的 (文件路径, 缓存的结果行, 文件状态)
+    """
+    for entry in entries:
+        path = entry.path if isinstance(entry, os.DirEntry) else entry
+        row = stat = None
+        if cache is not None:
+            key = os.path.abspath(path)
+            if seen is not None:
+                seen.add(key)
+            try:
+                stat = entry.stat() if isinstance(entry, os.DirEntry) else os.stat(path)
+                row = cache.get(key, stat)
+            except OSError:
+                pass
+        yield path, row, stat
+
+
+def run_extraction(folder_path, output_file=None, workers=DEFAULT_WORKERS, listener=None, processes=0, cache=None,
+                   include=None, exclude=None, scan_workers=1, output_format=None):
+    """
+    提取文件夹下所有XML文件的信息并保存到输出文件
+
+    参数:
+        folder_path (str): 包含XML文件的文件夹
+        output_file (str): 输出文件路径，默认为文件夹下的 xml_extraction_result，扩展名跟随输出格式
+        workers (int): 并行解析的线程数
+        listener (ExtractionListener): 事件回调，为None时不输出任何信息
+        processes (int): 并行解析的进程数，为0时只用线程
+        cache (ExtractionCache): 提取结果缓存，为None时每个文件都重新解析
+        include (iterable): 要处理的文件的通配符，默认为 *.xml
+        exclude (iterable): 要跳过的文件或目录的通配符
+        scan_workers (int): 并行扫描目录的线程数
+        output_format (str): 输出格式（csv、xlsx、parquet、jsonl），为None时根据输出文件扩展名推断
+
+    返回:
+        int: 处理的文件数，没有找到XML文件时为0（不生成输出文件）
+    """
+    listener = listener or ExtractionListener()
+    output_file = output_file or default_output_file(folder_path, output_format)
+
+    # 扫描在后台线程中进行，找到的文件立即交给解析，不必等整个目录树遍历完
+    scanner = XMLFileScanner(folder_path, include, exclude, scan_workers)
+    seen = set()
+
+    # 结果边处理边写出，找到第一个文件时才创建输出文件
+    writer = None
+    preview_rows = []
+    parsed = 0
+    started = False
+    try:
+        for i, ((xml_file, cached, stat), row, digest) in enumerate(
+                extract_ordered(lookup_cache(iter_in_background(scanner), cache, seen), workers, processes,
+                                cache is not None and cache.use_hash)):
+            if cached is None:
+                parsed += 1
+                if cache is not None and stat is not None:
+                    cache.put(os.path.abspath(xml_file), stat, row, digest)
+            if writer is None:
+                writer = open_result_writer(output_file, output_format)
+            # 输出文件刷新到磁盘时缓存也一起提交，中断后下次可以接着用
+            if writer.write(row) and cache is not None:
+                cache.commit()
+            if len(preview_rows) < PREVIEW_ROWS:
+                preview_rows.append(row)
+            listener.on_file(i, max(i + 1, scanner.estimate()), xml_file, row)
+            # 后台扫描完成后立即报告总文件数，不必等所有文件处理完
+            if not started and scanner.done:
+                listener.on_start(scanner.files_found)
+                started = True
+    finally:
+        if writer is not None:
+            writer.close()
+        if cache is not None:
+            cache.commit()
+    if not started:
+        listener.on_start(scanner.files_found)
+
+    count = writer.count if writer is not None else 0
+    if cache is not None:
+        cache.prune(os.path.abspath(folder_path), seen)
+        cache.commit()
+        listener.on_message(f"缓存命中 {count - parsed} 个文件，重新解析 {parsed} 个，"
+                            f"清理已删除文件的缓存 {cache.stats['pruned']} 条")
+    if count:
+        listener.on_finish(output_file, count, preview_rows)
+    return count
+
+
+class ChangeCollector:
+    """
+    收集监视到的文件变化，合并去重后按防抖间隔成批取出
+
+    事件来源（watchdog 的回调线程或轮询线程）只调用 add，处理线程调用 wait_batch 阻塞等待，
+    没有变化时不占用CPU
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.paths = set()
+        self.last_change = 0.0
+
+    def add(self, path):
+        with self.lock:
+            self.paths.add(path)
+            self.last_change = time.monotonic()
+        self.changed.set()
+
+    def dispatch(self, event):
+        """
+        watchdog 事件回调，记录涉及的路径
+
+        只读打开、关闭的事件（提取时读取文件也会产生）和目录自身的修改事件（子文件变化时产生）忽略
+        """
+        if event.event_type not in WATCH_EVENT_TYPES or (event.is_directory and event.event_type == "modified"):
+            return
+        self.add(event.src_path)
+        if getattr(event, "dest_path", None):
+            self.add(event.dest_path)
+
+    def wait_batch(self, debounce=DEFAULT_DEBOUNCE, timeout=None, stop_event=None):
+        """
+        等待一批变化：有变化后继续等到 debounce 秒内没有新变化，再一次取出全部路径
+
+        参数:
+            debounce (float): 防抖间隔秒数
+            timeout (float): 最多等待的秒数，为None时一直等到有变化或停止
+            stop_event (threading.Event): 设置后尽快返回
+
+        返回:
+            set: 变化的路径，超时或停止时可能为空
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not (stop_event is not None and stop_event.is_set()):
+            # 有 stop_event 时每0.5秒醒来检查一次是否需要停止
+            wait = 0.5 if stop_event is not None else None
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.monotonic())
+                wait = remaining if wait is None else min(wait, remaining)
+            if self.changed.wait(wait):
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+        while not (stop_event is not None and stop_event.is_set()):
+            with self.lock:
+                quiet = time.monotonic() - self.last_change
+            if quiet >= debounce:
+                break
+            time.sleep(debounce - quiet)
+        with self.lock:
+            paths, self.paths = self.paths, set()
+            self.changed.clear()
+        return paths
+
+
+def snapshot(scanner):
+    """遍历一次文件夹，返回 {文件路径: (大小, 修改时间)}，供轮询比较"""
+    result = {}
+    for entry in scanner:
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        result[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return result
+
+
+def poll_changes(folder_path, include, exclude, collector, interval, stop_event):
+    """轮询线程：每隔 interval 秒遍历一次文件夹，把新增、修改和删除的文件交给 collector"""
+    previous = snapshot(XMLFileScanner(folder_path, include, exclude))
+    while not stop_event.wait(interval):
+        current = snapshot(XMLFileScanner(folder_path, include, exclude))
+        for path in current.keys() | previous.keys():
+            if current.get(path) != previous.get(path):
+                collector.add(path)
+        previous = current
+
+
+class RecordingListener(ExtractionListener):
+    """转发给另一个 listener，同时按文件记录结果行，监视模式用来增量更新输出"""
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.rows = {}
+
+    def on_start(self, total):
+        self.listener.on_start(total)
+
+    def on_message(self, text):
+        self.listener.on_message(text)
+
+    def on_file(self, index, total, xml_file, row):
+        self.rows[os.path.abspath(xml_file)] = row
+        self.listener.on_file(index, total, xml_file, row)
+
+    def on_finish(self, output_file, count, preview_rows):
+        self.listener.on_finish(output_file, count, preview_rows)
+
+
+def write_results_atomic(output_file, rows, output_format=None):
+    """
+    先写到同一目录下的临时文件再替换，读取方不会看到写了一半的输出
+
+    临时文件由写入对象按普通方式新建，替换后的输出文件保持原来的权限
+    """
+    temp_path = os.path.join(os.path.dirname(os.path.abspath(output_file)),
+                             f".{os.path.basename(output_file)}.{os.urandom(6).hex()}.tmp")
+    try:
+        write_results(temp_path, rows, output_format or infer_output_format(output_file))
+        if os.path.exists(output_file):
+            shutil.copymode(output_file, temp_path)
+        os.replace(temp_path, output_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def apply_changes(paths, rows, scanner, cache=None, workers=DEFAULT_WORKERS):
+    """
+    按一批变化的路径更新结果行：新增或修改的文件重新提取，删除的文件（或目录下的文件）移除
+
+    参数:
+        paths (iterable): 变化的文件或目录路径
+        rows (dict): {绝对路径: 结果行}，原地更新，新文件追加在末尾
+        scanner (XMLFileScanner): 用来判断文件是否匹配通配符、遍历新增的目录
+        cache (ExtractionCache): 提取结果缓存，为None时不使用
+        workers (int): 并行解析的线程数
+
+    返回:
+        tuple: (更新的文件数, 移除的文件数)
+    """
+    to_extract = []
+    removed = 0
+    for path in sorted(paths):
+        key = os.path.abspath(path)
+        if os.path.isdir(path):
+            to_extract.extend(entry.path for entry in XMLFileScanner(
+                scanner.folder_path, scanner.include, scanner.exclude, start_path=path))
+        elif os.path.isfile(path) and scanner.accepts(path):
+            to_extract.append(path)
+        else:
+            # 文件或目录已删除、移走，或者不再匹配通配符
+            prefix = os.path.join(key, "")
+            for gone in [k for k in rows if k == key or k.startswith(prefix)]:
+                del rows[gone]
+                if cache is not None:
+                    cache.delete(gone)
+                removed += 1
+
+    # 新目录的创建事件和其中文件的事件可能同时出现，去掉重复的文件
+    to_extract = list(dict.fromkeys(to_extract))
+    for (xml_file, cached, stat), row, digest in extract_ordered(
+            lookup_cache(to_extract, cache), workers, 0, cache is not None and cache.use_hash):
+        if cached is None and cache is not None and stat is not None:
+            cache.put(os.path.abspath(xml_file), stat, row, digest)
+        rows[os.path.abspath(xml_file)] = row
+    if cache is not None:
+        cache.commit()
+    return len(to_extract), removed
+
+
+def watch_folder(folder_path, output_file=None, workers=DEFAULT_WORKERS, listener=None, processes=0, cache=None,
+                 include=None, exclude=None, scan_workers=1, debounce=DEFAULT_DEBOUNCE, poll_interval=None,
+                 stop_event=None, output_format=None):
+    """
+    监视模式：先完整提取一次，之后只重新提取新增、修改或删除的XML文件，并原子地更新输出文件
+
+    安装了 watchdog 时使用系统的文件变化通知，没有变化时不占用CPU；
+    没有安装或指定了 poll_interval 时每隔 poll_interval 秒遍历一次文件夹
+
+    参数:
+        folder_path (str): 要监视的文件夹
+        output_file (str): 输出文件路径，默认为文件夹下的 xml_extraction_result，扩展名跟随输出格式
+        workers, listener, processes, cache, include, exclude, scan_workers, output_format: 同 run_extraction
+        debounce (float): 防抖间隔秒数
+        poll_interval (float): 轮询间隔秒数，为None时优先使用 watchdog
+        stop_event (threading.Event): 设置后停止监视，为None时一直运行到 KeyboardInterrupt
+    """
+    listener = listener or ExtractionListener()
+    output_file = output_file or default_output_file(folder_path, output_format)
+    stop_event = stop_event or threading.Event()
+    scanner = XMLFileScanner(folder_path, include, exclude)
+
+    # 先开始监视再做完整提取，提取过程中发生的变化也不会漏掉
+    collector = ChangeCollector()
+    observer = None
+    if Observer is not None and poll_interval is None:
+        observer = Observer()
+        observer.schedule(collector, folder_path, recursive=True)
+        observer.start()
+        mode = "系统文件变化通知"
+    else:
+        poll_interval = poll_interval or DEFAULT_POLL_INTERVAL
+        threading.Thread(target=poll_changes, daemon=True,
+                         args=(folder_path, include, exclude, collector, poll_interval, stop_event)).start()
+        mode = f"每 {poll_interval:g} 秒轮询"
+
+    try:
+        recorder = RecordingListener(listener)
+        run_extraction(folder_path, output_file, workers, recorder, processes, cache, include, exclude, scan_workers,
+                       output_format)
+        rows = recorder.rows
+        listener.on_message(f"正在监视 {folder_path}（{mode}）")
+
+        dirty = False
+        while not stop_event.is_set():
+            paths = collector.wait_batch(debounce, WRITE_RETRY_SECONDS if dirty else None, stop_event)
+            if paths:
+                updated, removed = apply_changes(paths, rows, scanner, cache, workers)
+                if updated or removed:
+                    listener.on_message(f"{time.strftime('%H:%M:%S')} 重新提取 {updated} 个文件，移除 {removed} 个")
+                    dirty = True
+            if dirty:
+                try:
+                    write_results_atomic(output_file, rows.values(), output_format)
+                    dirty = False
+                except OSError as e:
+                    listener.on_message(f"更新输出文件失败，稍后重试: {str(e)}")
+    finally:
+        stop_event.set()
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="提取文件夹下所有XML文件的描述、Expage名称和CPT文件引用")
+    parser.add_argument("folder", help="包含XML文件的文件夹")
+    parser.add_argument("-o", "--output", help=f"输出文件路径，默认为文件夹下的 {OUTPUT_FILE_NAME}（扩展名跟随输出格式）")
+    parser.add_argument("-f", "--format", choices=list(OUTPUT_FORMATS),
+                        help="输出格式，默认根据输出文件扩展名推断，无法识别时为 csv")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="并行解析的线程数")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help=f"并行解析的进程数，0表示只用线程；文件少于 {PROCESS_MIN_FILES} 个时不启动进程池")
+    parser.add_argument("--include", action="append",
+                        help="要处理的文件的通配符，可以指定多次，含 / 时匹配相对路径，默认为 *.xml")
+    parser.add_argument("--exclude", action="append", help="要跳过的文件或目录的通配符，可以指定多次")
+    parser.add_argument("--scan-workers", type=int, default=1, help="并行扫描目录的线程数，适合网络共享盘")
+    parser.add_argument("--cache", help="提取结果缓存文件路径，应在本机磁盘上，默认保存在用户缓存目录中")
+    parser.add_argument("--no-cache", action="store_true", help="不使用缓存，重新解析所有文件")
+    parser.add_argument("--hash", action="store_true", help="修改时间变化时再比较内容哈希，内容没变的文件仍使用缓存")
+    parser.add_argument("--watch", action="store_true", help="提取后继续监视文件夹，只重新提取变化的文件")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE, help="监视模式的防抖间隔（秒）")
+    parser.add_argument("--poll-interval", type=float,
+                        help=f"监视模式改用轮询及其间隔（秒），未安装 watchdog 时默认每 {DEFAULT_POLL_INTERVAL:g} 秒轮询")
+    parser.add_argument("-v", "--verbose", action="store_true", help="打印每个文件的提取结果")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"文件夹不存在: {args.folder}")
+    output_format = args.format or (infer_output_format(args.output) if args.output else "csv")
+    if output_format not in available_formats():
+        parser.error(OUTPUT_FORMATS[output_format][2])
+    cache = None if args.no_cache else ExtractionCache(args.cache or default_cache_path(args.folder),
+                                                       use_hash=args.hash)
+    try:
+        if args.watch:
+            print("按 Ctrl-C 停止监视")
+            try:
+                watch_folder(args.folder, args.output, args.workers, ConsoleListener(args.verbose), args.processes,
+                             cache, args.include, args.exclude, args.scan_workers, args.debounce, args.poll_interval,
+                             output_format=output_format)
+            except KeyboardInterrupt:
+                print("已停止监视")
+            sys.exit(0)
+        count = run_extraction(args.folder, args.output, args.workers, ConsoleListener(args.verbose),
+                               args.processes, cache, args.include, args.exclude, args.scan_workers, output_format)
+    finally:
+        if cache is not None:
+            cache.close()
+    if not count:
+        print("未找到XML文件")
+        sys.exit(1)
@@ -2,127 +2,1728 @@ import requests
 import time
 import json
 import csv
+import os
+import sys
+import argparse
+import random
+import shutil
+import sqlite3
+from urllib.parse import urlencode
+from collections import deque, OrderedDict
+from decimal import Decimal
+from contextlib import contextmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm  # 用于显示进度条，可选
 
+# JSON解析后端：优先使用已安装的 orjson / ujson，都没有时使用标准库 json
+# 标准库 json.loads 直接解析bytes时要先探测编码，比先按UTF-8解码成str再解析慢
+JSON_BACKENDS = {"json": lambda content: json.loads(content.decode("utf-8"))}
+try:
+    import ujson
+    JSON_BACKENDS["ujson"] = ujson.loads
+except ImportError:
+    pass
+try:
+    import orjson
+    JSON_BACKENDS["orjson"] = orjson.loads
+except ImportError:
+    pass
+JSON_BACKEND = os.environ.get("SSE_JSON_BACKEND") or next(
+    name for name in ("orjson", "ujson", "json") if name in JSON_BACKENDS)
+json_loads = JSON_BACKENDS.get(JSON_BACKEND, json.loads)
 
-def get_stock_info(stock_code):
+try:
+    import pandas as pd
+except ImportError:  # 列式处理（--columnar）需要 pandas（及其依赖的 numpy），未安装时不可用
+    pd = None
+
+DEFAULT_WORKERS = 8  # 默认并发线程数
+DEFAULT_RATE = 10.0  # 默认全局限速（每秒请求数）
+POOL_SIZE = 32  # 连接池大小，应不小于并发线程数
+DEFAULT_CACHE_FILE = "sse_response_cache.db"  # 默认响应缓存文件
+DEFAULT_CACHE_TTL = 24 * 3600  # 缓存有效期（秒）
+DEFAULT_CACHE_SIZE = 20000  # 缓存最多保存的响应条数
+DEFAULT_INDEX_FILE = "sse_stock_index.db"  # 默认的每只股票最新状态索引文件
+DEFAULT_HISTORY_FILE = "sse_history.db"  # 默认的历史股本数据库文件
+DEFAULT_MAX_AGE = 7 * 24 * 3600  # 增量模式下索引记录的最长信任时间（秒）
+DEFAULT_SAMPLE_SIZE = 20  # 无法获取变更数据时抽样检查的股票数
+DEFAULT_RETRIES = 3  # 单个请求失败后的最多重试次数
+REQUEST_TIMEOUT = 15  # 单个请求超时时间（秒）
+THROTTLE_STATUS = (403, 429, 503)  # 视为被限流的HTTP状态码
+DEDUP_MEMO_SIZE = 10000  # process_csv 中按代码去重时最多记住的代码数
+
+
+class TokenBucket:
     """
-    获取股票信息
+    令牌桶限速器，多个线程共享同一个实例即可限制全局请求速率
 
     参数:
-        stock_code (str): 股票代码，如"600000"
+        rate (float): 每秒补充的令牌数，即每秒最多请求数
+        burst (int): 桶容量，允许的瞬时突发请求数，默认为1（请求均匀分布）
+    """
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate 必须大于0")
+        self.rate = float(rate)
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取走一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# 未指定限速器时使用的全局限速器
+_default_limiter = TokenBucket(DEFAULT_RATE)
+
+
+class ThrottledError(Exception):
+    """服务器返回限流状态码或非JSONP内容（通常是拦截页面）"""
+
+
+class AdaptiveController:
+    """
+    自适应并发与重试控制器，多个线程共享同一个实例
+
+    - AIMD 调整在途请求数上限：请求成功且延迟正常时每轮加1，出错、被限流或延迟明显升高时减半；
+      延迟与同类请求（每个 sqlId 的单个代码查询和分页查询分开）最近延迟的指数加权平均比较，
+      网络正常抖动不会把上限压到1
+    - 失败的请求按带随机抖动的指数退避重试
+    - 连续失败达到阈值时熔断，暂停发送请求一段时间后只放行一个探测请求，成功才恢复
+
+    参数:
+        max_concurrency (int): 在途请求数上限的最大值，一般等于线程数
+        max_retries (int): 单个请求的最多重试次数
+        base_backoff (float): 首次重试的最长等待时间（秒）
+        max_backoff (float): 重试等待时间的上限（秒）
+        breaker_threshold (int): 触发熔断的连续失败次数
+        breaker_cooldown (float): 熔断持续时间（秒）
+    """
+
+    LATENCY_FACTOR = 3.0  # 延迟超过基线延迟的倍数时视为拥塞
+    LATENCY_SLACK = 0.1  # 比基线延迟多出不到这么多秒时不算拥塞，避免本机或极快网络上的抖动触发减半
+    BASELINE_ALPHA = 0.1  # 基线延迟（指数加权平均）中最新一次延迟的权重
+
+    def __init__(self, max_concurrency=DEFAULT_WORKERS, max_retries=DEFAULT_RETRIES, base_backoff=0.5,
+                 max_backoff=30.0, breaker_threshold=10, breaker_cooldown=30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = max(1.0, self.max_concurrency / 2)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.baselines = {}
+        self.last_decrease = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.half_open = False
+        self.stats = {"requests": 0, "retries": 0, "errors": 0, "throttled": 0, "breaker_trips": 0}
+
+    def acquire(self):
+        """等待一个在途请求名额；熔断期间阻塞，半开状态下只允许一个探测请求"""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if now < self.open_until:
+                    self.cond.wait(self.open_until - now)
+                    continue
+                capacity = 1 if self.half_open else int(self.limit)
+                if self.in_flight < capacity:
+                    self.in_flight += 1
+                    self.stats["requests"] += 1
+                    return
+                self.cond.wait()
+
+    def release(self, latency, ok, throttled=False, key=None):
+        """归还名额，并根据本次请求的结果调整并发上限和熔断状态；key 区分延迟基线不同的请求类型"""
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            baseline = self.baselines.get(key)
+            if ok:
+                self.consecutive_failures = 0
+                self.half_open = False
+                if (baseline is not None and latency > baseline * self.LATENCY_FACTOR
+                        and latency - baseline > self.LATENCY_SLACK):
+                    self._decrease(now, baseline)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.baselines[key] = latency if baseline is None else (
+                    baseline + self.BASELINE_ALPHA * (latency - baseline))
+            else:
+                self.consecutive_failures += 1
+                self.stats["errors"] += 1
+                if throttled:
+                    self.stats["throttled"] += 1
+                self._decrease(now, baseline)
+                if self.half_open or self.consecutive_failures >= self.breaker_threshold:
+                    self.open_until = now + self.breaker_cooldown
+                    self.half_open = True
+                    self.stats["breaker_trips"] += 1
+                    print(f"连续 {self.consecutive_failures} 次请求失败，暂停 {self.breaker_cooldown:.0f} 秒")
+            self.cond.notify_all()
+
+    def _decrease(self, now, baseline=None):
+        # 同一次拥塞往往会让多个在途请求同时失败，间隔不到一个基线延迟时只减半一次
+        if now - self.last_decrease >= (baseline or 1.0):
+            self.limit = max(1.0, self.limit / 2)
+            self.last_decrease = now
+
+    def call(self, func, before=None, key=None):
+        """
+        在控制器下执行一次请求，失败时按指数退避重试，重试用尽后抛出最后一次的异常
+
+        before 在每次尝试占用在途名额之前调用（一般是从限速器取令牌），
+        其等待时间不计入延迟，否则限速排队会被当成服务端拥塞而降低并发上限；key 同 release
+        """
+        for attempt in range(self.max_retries + 1):
+            if before is not None:
+                before()
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                self.release(time.monotonic() - start, ok=False, throttled=isinstance(e, ThrottledError), key=key)
+                if attempt >= self.max_retries:
+                    raise
+                with self.cond:
+                    self.stats["retries"] += 1
+                time.sleep(random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt)))
+                continue
+            self.release(time.monotonic() - start, ok=True, key=key)
+            return result
+
+    def summary(self):
+        """返回请求统计的简要说明"""
+        with self.cond:
+            return (f"共发送 {self.stats['requests']} 个请求，重试 {self.stats['retries']} 次，"
+                    f"失败 {self.stats['errors']} 次（其中限流 {self.stats['throttled']} 次），"
+                    f"熔断 {self.stats['breaker_trips']} 次，最终并发上限 {int(self.limit)}")
+
+# 可用环境变量 SSE_BASE_URL 指向本地回放服务器（见 上交所数据提取基准测试.py serve）
+BASE_URL = os.environ.get("SSE_BASE_URL", "https://query.sse.com.cn/commonQuery.do")
+HEADERS = {
+    "Host": "query.sse.com.cn",
+    "Referer": "https://www.sse.com.cn/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/91.0.4472.124 Safari/537.36"
+}
+VOLUME_SQL_ID = "COMMON_SSE_CP_GPJCTPZ_GPLB_GPGK_GBJG_C"  # 股本结构
+COMPANY_SQL_ID = "COMMON_SSE_CP_GPJCTPZ_GPLB_GPGK_GSGK_C"  # 公司概况
+BULK_PAGE_SIZE = 100  # 批量模式每页条数
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """获取全局共享的 requests.Session，复用 keep-alive 连接，避免每次请求重新握手"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+_request_executor = None
+_inflight = {}  # 正在进行中的请求，相同请求合并为一次
+_inflight_lock = threading.Lock()
+
+
+def get_request_executor():
+    """获取全局共享的线程池，用于和当前线程并行发出同一只股票的另一个查询"""
+    global _request_executor
+    with _session_lock:
+        if _request_executor is None:
+            _request_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="sse-request")
+    return _request_executor
+
+
+class ResponseCache:
+    """
+    基于SQLite的持久化响应缓存，以数据集（sqlId 加额外参数，见 cache_dataset）+ COMPANY_CODE 为键
+
+    每条缓存都记录写入时已知的最新 TRADE_DATE。一旦新请求返回了更新的 TRADE_DATE，
+    旧交易日的缓存全部作废；此外超过有效期的缓存也不再使用，
+    条数超过上限时淘汰最久未访问的记录。
+
+    参数:
+        path (str): 缓存文件路径
+        ttl (float): 有效期（秒）
+        max_entries (int): 最多保存的条数
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                sql_id TEXT NOT NULL,
+                code TEXT NOT NULL,
+                trade_date TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (sql_id, code)
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'trade_date'").fetchone()
+        self.trade_date = row[0] if row else ""
+
+    def get(self, sql_id, code):
+        """返回缓存的响应，没有或已失效时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload, trade_date, created FROM responses WHERE sql_id = ? AND code = ?",
+                (sql_id, code)).fetchone()
+            if row is None:
+                return None
+            payload, trade_date, created = row
+            if time.time() - created > self.ttl or trade_date < self.trade_date:
+                self.conn.execute("DELETE FROM responses WHERE sql_id = ? AND code = ?", (sql_id, code))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE sql_id = ? AND code = ?",
+                              (time.time(), sql_id, code))
+            self.conn.commit()
+        return json.loads(payload)
+
+    def put(self, sql_id, code, data):
+        """写入一条响应，并根据其中的 TRADE_DATE 更新已知的最新交易日"""
+        trade_date = ""
+        for item in data.get("result") or []:
+            trade_date = max(trade_date, str(item.get("TRADE_DATE") or ""))
+
+        now = time.time()
+        with self.lock:
+            self._observe_trade_date(trade_date)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (sql_id, code, max(trade_date, self.trade_date), json.dumps(data, ensure_ascii=False), now, now))
+            count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE rowid IN "
+                    "(SELECT rowid FROM responses ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,))
+            self.conn.commit()
+
+    def discard(self, sql_id, codes=None):
+        """删除一个数据集中指定代码的缓存，codes 为None时删除该数据集的全部缓存"""
+        with self.lock:
+            if codes is None:
+                self.conn.execute("DELETE FROM responses WHERE sql_id = ?", (sql_id,))
+            else:
+                self.conn.executemany("DELETE FROM responses WHERE sql_id = ? AND code = ?",
+                                      [(sql_id, code) for code in codes])
+            self.conn.commit()
+
+    def observe_trade_date(self, trade_date):
+        """记录在其他请求（如批量查询）中看到的交易日，比已知的更新时旧缓存随之作废"""
+        with self.lock:
+            self._observe_trade_date(str(trade_date or ""))
+            self.conn.commit()
+
+    def _observe_trade_date(self, trade_date):
+        if trade_date > self.trade_date:
+            self.trade_date = trade_date
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('trade_date', ?)", (trade_date,))
+            self.conn.execute("DELETE FROM responses WHERE trade_date < ?", (trade_date,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# 每次查询都带的参数，不区分数据集
+COMMON_PARAMS = ("jsonCallBack", "isPagination", "sqlId", "COMPANY_CODE", "_")
+
+
+def cache_dataset(sql_id, extra_params=None):
+    """响应缓存中的数据集名：sqlId 加上排好序的额外参数，sqlId 相同而参数不同的查询不会共用缓存"""
+    if not extra_params:
+        return sql_id
+    return sql_id + "?" + urlencode(sorted((str(name), str(value)) for name, value in extra_params.items()))
+
+
+class RequestMetrics:
+    """
+    请求级别的统计，多个线程共享同一个实例
+
+    每个实际发出的请求（包括每次重试）记录 sqlId、代码、HTTP状态、延迟、响应字节数、
+    解析耗时、第几次尝试、限速器等待时间和排队时间（并发控制器等待加重试退避）。
+    运行结束后可导出为JSON和 Prometheus textfile，用于判断瓶颈在上交所、解析还是本地限速。
+
+    参数:
+        keep_events (bool): 是否在JSON中保留每个请求的明细
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 延迟直方图的分桶上限（秒）
+
+    def __init__(self, keep_events=True):
+        self.keep_events = keep_events
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.events = []
+        self.by_sql_id = {}
+        self.errors = {}
+        self.timeline = {}
+        self.counters = {"cache_hits": 0, "coalesced": 0, "retries": 0}
+
+    def record(self, sql_id, code, status, latency, size, parse_time, queued, limiter_wait, attempt, error=None):
+        """记录一次实际发出的请求"""
+        now = time.time()
+        with self.lock:
+            stats = self.by_sql_id.get(sql_id)
+            if stats is None:
+                stats = self.by_sql_id[sql_id] = {
+                    "requests": 0, "errors": 0, "bytes": 0, "latency": 0.0, "parse": 0.0, "queued": 0.0,
+                    "limiter_wait": 0.0, "latencies": [], "buckets": [0] * len(self.LATENCY_BUCKETS),
+                    "status": {}}
+            stats["requests"] += 1
+            stats["bytes"] += size
+            stats["latency"] += latency
+            stats["parse"] += parse_time
+            stats["queued"] += queued
+            stats["limiter_wait"] += limiter_wait
+            stats["latencies"].append(latency)
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if latency <= bound:
+                    stats["buckets"][i] += 1
+            stats["status"][str(status)] = stats["status"].get(str(status), 0) + 1
+            if error:
+                stats["errors"] += 1
+                self.errors[error] = self.errors.get(error, 0) + 1
+            if attempt > 0:
+                self.counters["retries"] += 1
+            second = int(now - self.start)
+            self.timeline[second] = self.timeline.get(second, 0) + 1
+            if self.keep_events:
+                self.events.append({
+                    "time": round(now - self.start, 4), "sql_id": sql_id, "code": code, "status": status,
+                    "latency": round(latency, 4), "bytes": size, "parse_time": round(parse_time, 6),
+                    "queued": round(queued, 4), "limiter_wait": round(limiter_wait, 4),
+                    "attempt": attempt, "error": error})
+
+    def count(self, name):
+        """累加缓存命中、合并请求等计数"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def summary(self):
+        """
+        汇总统计
+
+        返回:
+            dict: 各sqlId的请求数、错误数、字节数、延迟分位数和各阶段耗时，错误分类，
+                  每秒请求数时间线和计数器
+        """
+        with self.lock:
+            by_sql_id = {}
+            for sql_id, stats in self.by_sql_id.items():
+                latencies = sorted(stats["latencies"])
+                by_sql_id[sql_id] = {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "bytes": stats["bytes"],
+                    "status": dict(stats["status"]),
+                    "latency_p50": latencies[int(0.5 * (len(latencies) - 1))],
+                    "latency_p90": latencies[int(0.9 * (len(latencies) - 1))],
+                    "latency_p99": latencies[int(0.99 * (len(latencies) - 1))],
+                    "latency_histogram": dict(zip(map(str, self.LATENCY_BUCKETS), stats["buckets"])),
+                    # 各阶段累计耗时：网络请求、JSON解析、本地排队（并发控制和重试退避）、令牌桶等待
+                    "time_spent": {"request": stats["latency"], "parse": stats["parse"],
+                                   "queued": stats["queued"], "limiter_wait": stats["limiter_wait"]},
+                }
+            duration = max(time.time() - self.start, 1e-9)
+            return {
+                "duration": duration,
+                "requests": sum(stats["requests"] for stats in self.by_sql_id.values()),
+                "requests_per_sec": sum(stats["requests"] for stats in self.by_sql_id.values()) / duration,
+                "by_sql_id": by_sql_id,
+                "errors": dict(self.errors),
+                "throughput": [{"second": second, "requests": count}
+                               for second, count in sorted(self.timeline.items())],
+                "counters": dict(self.counters),
+            }
+
+    def export_json(self, path):
+        """导出汇总统计（以及请求明细）为JSON文件"""
+        data = self.summary()
+        if self.keep_events:
+            with self.lock:
+                data["events"] = list(self.events)
+        with atomic_open(path, encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def export_prometheus(self, path):
+        """导出为 node_exporter textfile collector 可读取的 Prometheus 文本格式"""
+        with self.lock:
+            lines = [
+                "# HELP sse_requests_total SSE commonQuery.do requests by sqlId and HTTP status.",
+                "# TYPE sse_requests_total counter",
+            ]
+            for sql_id, stats in self.by_sql_id.items():
+                for status, count in stats["status"].items():
+                    lines.append(f'sse_requests_total{{sql_id="{sql_id}",status="{status}"}} {count}')
+
+            lines += ["# HELP sse_request_duration_seconds SSE request latency.",
+                      "# TYPE sse_request_duration_seconds histogram"]
+            for sql_id, stats in self.by_sql_id.items():
+                for bound, count in zip(self.LATENCY_BUCKETS, stats["buckets"]):
+                    lines.append(f'sse_request_duration_seconds_bucket{{sql_id="{sql_id}",le="{bound}"}} {count}')
+                lines.append(f'sse_request_duration_seconds_bucket{{sql_id="{sql_id}",le="+Inf"}} '
+                             f'{stats["requests"]}')
+                lines.append(f'sse_request_duration_seconds_sum{{sql_id="{sql_id}"}} {stats["latency"]:.6f}')
+                lines.append(f'sse_request_duration_seconds_count{{sql_id="{sql_id}"}} {stats["requests"]}')
+
+            for name, key, help_text in (
+                    ("sse_response_bytes_total", "bytes", "Response body bytes."),
+                    ("sse_parse_seconds_total", "parse", "Time spent decoding JSONP responses."),
+                    ("sse_queued_seconds_total", "queued", "Time spent waiting for the concurrency controller "
+                                                           "and retry backoff."),
+                    ("sse_limiter_wait_seconds_total", "limiter_wait", "Time spent waiting for rate limit tokens.")):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for sql_id, stats in self.by_sql_id.items():
+                    lines.append(f'{name}{{sql_id="{sql_id}"}} {stats[key]}')
+
+            lines += ["# HELP sse_errors_total Failed requests by error type.", "# TYPE sse_errors_total counter"]
+            for error, count in self.errors.items():
+                error = error.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'sse_errors_total{{error="{error}"}} {count}')
+
+            for name, count in self.counters.items():
+                lines += [f"# TYPE sse_{name}_total counter", f"sse_{name}_total {count}"]
+
+        with atomic_open(path, encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def decode_jsonp(content, loads=None):
+    """
+    直接在原始响应bytes上去掉JSONP包装并解析
+
+    只按第一个左括号和最后一个右括号切片，不先解码成str，也不对整个响应做 replace；
+    没有JSONP包装（直接返回JSON）时整体解析
+
+    参数:
+        content (bytes): 响应体，如 b'jsonpCallback123({...})'
+        loads: JSON解析函数，默认使用 json_loads 选定的后端
 
     返回:
-        dict: 包含所有需要字段的字典
+        dict: 解析结果
+    """
+    loads = loads or json_loads
+    start = content.find(b"(")
+    if start != -1 and content[:start].strip()[:1] not in (b"{", b"["):
+        end = content.rfind(b")")
+        content = content[start + 1:end if end > start else len(content)]
+    return loads(content)
+
+
+def trim_payload(data, fields=None, first_only=False):
+    """
+    只保留后续会用到的部分，减少分页结果和缓存占用的内存
+
+    参数:
+        data (dict): decode_jsonp 的结果
+        fields (iterable): 每条记录保留的字段，为None时保留全部字段
+        first_only (bool): 只保留第一条记录（单个代码查询只用 result[0]）
+
+    返回:
+        dict: 只含 result 和去掉重复 data 列表的 pageHelp
+    """
+    records = data.get("result") or []
+    if first_only:
+        records = records[:1]
+    if fields is not None:
+        records = [{field: item[field] for field in fields if field in item} for item in records]
+    trimmed = {"result": records}
+    if data.get("pageHelp"):
+        # pageHelp.data 与 result 重复，只保留分页信息
+        trimmed["pageHelp"] = {key: value for key, value in data["pageHelp"].items() if key != "data"}
+    return trimmed
+
+
+def query_jsonp(params, limiter, cache=None, controller=None, metrics=None, fields=None):
+    """
+    发送一次 commonQuery.do 请求，去掉JSONP包装并解析为dict
+
+    带 COMPANY_CODE 的单个代码查询会先查缓存，命中时不发请求也不消耗令牌；
+    与正在进行中的请求参数相同时不再发送，直接等待并共享其结果；
+    指定 controller 时由其控制并发和重试，指定 metrics 时记录每次实际发出的请求；
+    指定 fields 时每条记录只保留这些字段（分页查询用），单个代码查询只保留第一条记录
+    """
+    code = params.get("COMPANY_CODE")
+    dataset = cache_dataset(params["sqlId"], {name: value for name, value in params.items()
+                                              if name not in COMMON_PARAMS})
+    if cache is not None and code:
+        data = cache.get(dataset, code)
+        if data is not None:
+            if metrics is not None:
+                metrics.count("cache_hits")
+            return data
+
+    key = tuple(sorted((name, value) for name, value in params.items() if name not in ("_", "jsonCallBack")))
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        if metrics is not None:
+            metrics.count("coalesced")
+        return future.result()
+
+    # 上一次尝试结束（或开始查询）的时间、本次尝试等待令牌的时间和尝试次数，用于计算排队时间
+    state = {"ready": time.monotonic(), "limiter_wait": 0.0, "attempt": 0}
+
+    def take_token():
+        waited = time.monotonic()
+        limiter.acquire()
+        state["limiter_wait"] = time.monotonic() - waited
+
+    def send():
+        if controller is None:
+            take_token()
+        sent = time.monotonic()
+        status, size, parse_time, error = 0, 0, 0.0, None
+        try:
+            response = get_session().get(BASE_URL, params=params, timeout=REQUEST_TIMEOUT)
+            status, size = response.status_code, len(response.content)
+            if response.status_code in THROTTLE_STATUS:
+                raise ThrottledError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            parse_start = time.monotonic()
+            try:
+                return trim_payload(decode_jsonp(response.content), fields, first_only=bool(code))
+            except (ValueError, AttributeError):
+                raise ThrottledError("返回内容不是JSONP数据")
+            finally:
+                parse_time = time.monotonic() - parse_start
+        except Exception as e:
+            error = f"HTTP {status}" if isinstance(e, ThrottledError) and status != 200 else type(e).__name__
+            raise
+        finally:
+            finished = time.monotonic()
+            if metrics is not None:
+                metrics.record(params["sqlId"], code or params.get("pageHelp.pageNo", ""), status,
+                               finished - sent - parse_time, size, parse_time,
+                               sent - state["ready"] - state["limiter_wait"], state["limiter_wait"], state["attempt"],
+                               error)
+            state["ready"] = finished
+            state["attempt"] += 1
+
+    try:
+        if controller is not None:
+            # 分页查询返回的数据多、延迟也不同，和单个代码查询分开计算延迟基线
+            data = controller.call(send, before=take_token, key=(params["sqlId"], bool(code)))
+        else:
+            data = send()
+        if cache is not None and code:
+            cache.put(dataset, code, data)
+        future.set_result(data)
+        return data
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def to_shares(value):
+    """
+    将以万股为单位的数值乘以10000并转换为整数（去掉小数点），无法转换时原样返回
+
+    用 Decimal 精确计算，避免 float 把 12.3456 算成 123455.99999 再截断成 123455
+    """
+    if value == "N/A":
+        return value
+    try:
+        return str(int(Decimal(str(value).strip()) * 10000))
+    except (ArithmeticError, ValueError, TypeError):
+        return value
+
+
+def shares_column(values):
+    """
+    to_shares 的列式版本：整列字符串按小数点拆分后用整数运算精确地乘以10000
+
+    参数:
+        values: 以万股为单位的数值列（字符串或数字）
+
+    返回:
+        pandas.Series: Int64 列，无法转换的值为缺失值
     """
-    base_url = "https://query.sse.com.cn/commonQuery.do"
-    headers = {
-        "Host": "query.sse.com.cn",
-        "Referer": "https://www.sse.com.cn/",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-                      "Chrome/91.0.4472.124 Safari/537.36"
-    }
+    text = pd.Series(values, dtype="string").str.strip()
+    parts = text.str.extract(r"^([+-]?)(\d*)(?:\.(\d*))?$")
+    sign, integer, fraction = parts[0], parts[1], parts[2].fillna("")
+    valid = integer.notna() & ((integer != "") | (fraction != ""))
+    integer = pd.to_numeric(integer.where(integer != "", "0"), errors="coerce").astype("Int64")
+    # 超过4位的小数直接截断，与 int() 向零取整一致
+    fraction = pd.to_numeric(fraction.str[:4].str.pad(4, side="right", fillchar="0"),
+                             errors="coerce").astype("Int64")
+    shares = integer * 10000 + fraction
+    shares = shares.where(sign != "-", -shares)
+    return shares.where(valid, pd.NA).astype("Int64")
+
+
+# 字段转换函数，查询配置中按名称引用
+TRANSFORMS = {
+    "x10000": to_shares,
+}
+
+# 字段转换函数的列式版本，列式处理时整列转换
+COLUMN_TRANSFORMS = {
+    "x10000": shares_column,
+}
 
-    # 获取股本数据
-    def get_volume_data():
+# 查询配置，每项描述一个数据集：
+#   name: 数据集名称
+#   sql_id: commonQuery.do 的 sqlId
+#   params: 额外的查询参数
+#   fields: {结果字段: 转换函数名}，从 result[0] 中提取，缺失时为 "N/A"，不需要转换时为None
+#   columns: {CSV列名: 结果字段}，处理CSV时写回的列，CSV中没有的列追加到表头末尾
+#   required: 批量模式下，代码在所有 required 数据集中都有记录才直接使用批量结果
+QUERY_SPECS = [
+    {
+        "name": "volume",
+        "sql_id": VOLUME_SQL_ID,
+        "params": {},
+        "fields": {"TOTAL_DOMESTIC_VOL": "x10000", "TOTAL_UNLIMIT_VOL": "x10000", "TRADE_DATE": None},
+        "columns": {"总股本": "TOTAL_DOMESTIC_VOL", "流通股": "TOTAL_UNLIMIT_VOL"},
+        "required": True,
+    },
+    {
+        "name": "company",
+        "sql_id": COMPANY_SQL_ID,
+        "params": {},
+        "fields": {"FULL_NAME": None},
+        "columns": {},
+    },
+]
+
+
+def load_query_specs(spec_file):
+    """
+    从JSON文件读取额外的查询配置，格式与 QUERY_SPECS 相同
+
+    参数:
+        spec_file (str): JSON文件路径，内容为查询配置的列表
+
+    返回:
+        list: 内置配置加上文件中的配置
+    """
+    with open(spec_file, 'r', encoding='utf-8') as f:
+        specs = json.load(f)
+    for spec in specs:
+        if not spec.get("sql_id") or not spec.get("fields"):
+            raise ValueError(f"查询配置缺少 sql_id 或 fields: {spec}")
+        for transform in spec["fields"].values():
+            if transform and transform not in TRANSFORMS:
+                raise ValueError(f"未知的转换函数: {transform}")
+        spec.setdefault("name", spec["sql_id"])
+        spec.setdefault("params", {})
+        spec.setdefault("columns", {})
+    return QUERY_SPECS + specs
+
+
+def get_spec(specs, name):
+    """按名称查找查询配置"""
+    for spec in specs:
+        if spec["name"] == name:
+            return spec
+    raise KeyError(name)
+
+
+def extract_fields(spec, record, transform=True):
+    """
+    按查询配置从一条原始记录中提取并转换字段
+
+    参数:
+        spec (dict): 查询配置
+        record (dict): 接口返回的一条记录，没有时为None
+        transform (bool): 是否逐条转换；列式处理时先收集原始值，之后整列转换
+
+    返回:
+        dict: {结果字段: 值}，没有记录时为空
+    """
+    result = {}
+    if record:
+        for field, name in spec["fields"].items():
+            value = record.get(field, "N/A")
+            result[field] = TRANSFORMS[name](value) if transform and name else value
+    return result
+
+
+def build_table(raw_results, specs=None):
+    """
+    把 {股票代码: 原始字段} 整理成以代码为索引的 DataFrame，并按查询配置整列转换
+
+    需要转换的字段变成 Int64 列，其余字段为字符串列，缺失值为 pd.NA 而不是 "N/A"
+    """
+    fields = [field for spec in specs or QUERY_SPECS for field in spec["fields"]]
+    table = pd.DataFrame.from_dict(raw_results, orient="index", dtype="string")
+    table = table.reindex(columns=list(dict.fromkeys(fields))).astype("string")
+    table = table.replace("N/A", pd.NA)
+    for spec in specs or QUERY_SPECS:
+        for field, name in spec["fields"].items():
+            if name:
+                table[field] = COLUMN_TRANSFORMS[name](table[field])
+    table.index.name = "A股代码"
+    return table
+
+
+class QueryScheduler:
+    """
+    按查询配置调度所有数据集的请求
+
+    所有数据集共用同一个限速器、并发控制器和缓存：单个代码的各数据集查询并行发出，
+    批量模式下各数据集并行分页拉取，拿到总页数后其余各页也并行请求。
+    增加数据集只增加请求数，不会成倍增加耗时。
+
+    参数:
+        specs (list): 查询配置，默认为 QUERY_SPECS
+        limiter (TokenBucket): 限速器，默认使用全局限速器
+        cache (ResponseCache): 响应缓存，为None时不使用缓存
+        controller (AdaptiveController): 并发与重试控制器，为None时失败不重试
+        page_size (int): 批量模式每页条数
+        metrics (RequestMetrics): 请求统计，为None时不记录
+    """
+
+    def __init__(self, specs=None, limiter=None, cache=None, controller=None, page_size=BULK_PAGE_SIZE,
+                 metrics=None):
+        self.specs = specs or QUERY_SPECS
+        self.limiter = limiter or _default_limiter
+        self.cache = cache
+        self.controller = controller
+        self.page_size = page_size
+        self.metrics = metrics
+
+    def query_code(self, spec, stock_code, transform=True):
+        """查询一只股票在一个数据集中的字段"""
         params = {
-            "jsonCallBack": f"jsonpCallback",
+            "jsonCallBack": f"jsonpCallback{int(time.time() * 1000)}",
             "isPagination": "false",
-            "sqlId": "COMMON_SSE_CP_GPJCTPZ_GPLB_GPGK_GBJG_C",
+            "sqlId": spec["sql_id"],
+            **spec.get("params", {}),
             "COMPANY_CODE": stock_code,
             "_": str(int(time.time() * 1000))
         }
-        response = requests.get(base_url, headers=headers, params=params)
-        json_str = response.text.replace(params["jsonCallBack"], "").strip("();")
-        return json.loads(json_str)
+        data = query_jsonp(params, self.limiter, self.cache, self.controller, self.metrics)
+        return extract_fields(spec, data["result"][0] if data.get("result") else None, transform)
+
+    def fetch_code(self, stock_code, transform=True):
+        """
+        获取一只股票在所有数据集中的字段；transform 为False时返回未转换的原始值
+
+        返回:
+            dict: 合并后的结果字典，任一数据集出错时为 {"error": 错误信息}
+        """
+        try:
+            # 第一个数据集在当前线程请求，其余的在共享线程池中并行请求
+            futures = [get_request_executor().submit(self.query_code, spec, stock_code, transform)
+                       for spec in self.specs[1:]]
+            result = self.query_code(self.specs[0], stock_code, transform)
+            for future in futures:
+                result.update(future.result())
+            return result
 
-    # 获取公司基本信息
-    def get_company_info():
+        except Exception as e:
+            print(f"获取股票 {stock_code} 数据时出错: {str(e)}")
+            return {"error": str(e)}
+
+    def query_page(self, spec, page_no):
+        """请求一个数据集的一页记录"""
         params = {
-            "jsonCallBack": f"jsonpCallback{int(time.time() * 1000)}",
-            "isPagination": "false",
-            "sqlId": "COMMON_SSE_CP_GPJCTPZ_GPLB_GPGK_GSGK_C",
-            "COMPANY_CODE": stock_code,
+            "jsonCallBack": "jsonpCallback",
+            "isPagination": "true",
+            "sqlId": spec["sql_id"],
+            **spec.get("params", {}),
+            "pageHelp.pageSize": str(self.page_size),
+            "pageHelp.pageNo": str(page_no),
+            "pageHelp.beginPage": str(page_no),
+            "pageHelp.cacheSize": "1",
+            "pageHelp.endPage": str(page_no),
             "_": str(int(time.time() * 1000))
         }
-        response = requests.get(base_url, headers=headers, params=params)
-        json_str = response.text.replace(params["jsonCallBack"], "").strip("();")
-        return json.loads(json_str)
+        fields = {"COMPANY_CODE", "TRADE_DATE", *spec["fields"]}
+        return query_jsonp(params, self.limiter, controller=self.controller, metrics=self.metrics, fields=fields)
 
-    try:
-        # 获取两部分数据
-        volume_data = get_volume_data()
-        company_data = get_company_info()
-        time.sleep(0.2)  # 避免请求过于频繁
+    def refresh_trade_date(self):
+        """
+        用一页不走缓存的股本数据查询获取当前最新交易日并告诉缓存，交易日更新时旧缓存随之作废
 
-        result = {}
+        全部代码都命中缓存时不会有新的响应，不先查一次的话旧交易日的数据会一直用到缓存过期
+        """
+        if self.cache is None:
+            return
+        try:
+            data = self.query_page(get_spec(self.specs, "volume"), 1)
+        except Exception as e:
+            print(f"获取最新交易日时出错，继续使用缓存: {str(e)}")
+            return
+        self.cache.observe_trade_date(max((str(item.get("TRADE_DATE") or "") for item in data.get("result") or []),
+                                          default=""))
 
-        # 处理股本数据
-        if volume_data.get("result") and len(volume_data["result"]) > 0:
-            vol_result = volume_data["result"][0]
-            total_domestic = vol_result.get("TOTAL_DOMESTIC_VOL", "N/A")
-            total_unlimit = vol_result.get("TOTAL_UNLIMIT_VOL", "N/A")
+    def query_all_pages(self, spec):
+        """
+        分页拉取一个数据集中所有公司的记录
+
+        返回:
+            dict: 以 COMPANY_CODE 为键的原始记录，同一代码有多条时只保留第一条
+        """
+        first_page = self.query_page(spec, 1)
+        page_count = int((first_page.get("pageHelp") or {}).get("pageCount") or 1)
+        futures = [get_request_executor().submit(self.query_page, spec, page_no)
+                   for page_no in range(2, page_count + 1)]
+
+        records = {}
+        for data in [first_page] + [future.result() for future in futures]:
+            for item in data.get("result") or []:
+                code = str(item.get("COMPANY_CODE", ""))
+                if code:
+                    records.setdefault(code, item)
+        return records
+
+    def fetch_bulk(self, transform=True):
+        """
+        批量模式：分页拉取所有数据集的全部记录，并按代码合并；transform 为False时返回未转换的原始值
+
+        返回:
+            dict: 以股票代码为键、与 fetch_code 结果格式相同的字典；拉取失败时为空
+        """
+        try:
+            # 各数据集在独立的线程中拉取，分页请求再提交到共享线程池，避免互相等待
+            with ThreadPoolExecutor(max_workers=len(self.specs)) as executor:
+                all_records = list(executor.map(self.query_all_pages, self.specs))
+        except Exception as e:
+            print(f"批量获取数据时出错，将逐个请求: {str(e)}")
+            return {}
+
+        if self.cache is not None:
+            self.cache.observe_trade_date(max((str(item.get("TRADE_DATE") or "")
+                                               for records in all_records for item in records.values()),
+                                              default=""))
+
+        required = [set(records) for spec, records in zip(self.specs, all_records) if spec.get("required")]
+        codes = set.intersection(*required) if required else set().union(*all_records)
+        results = {}
+        for code in codes:
+            result = {}
+            for spec, records in zip(self.specs, all_records):
+                result.update(extract_fields(spec, records.get(code), transform))
+            results[code] = result
+        return results
+
+
+def get_stock_info(stock_code, limiter=None, cache=None, controller=None):
+    """
+    获取股票信息
+
+    参数:
+        stock_code (str): 股票代码，如"600000"
+        limiter (TokenBucket): 限速器，每次请求前取一个令牌，默认使用全局限速器
+        cache (ResponseCache): 响应缓存，为None时不使用缓存
+        controller (AdaptiveController): 并发与重试控制器，为None时失败不重试
+
+    返回:
+        dict: 包含所有需要字段的字典
+    """
+    return QueryScheduler(QUERY_SPECS, limiter, cache, controller).fetch_code(stock_code)
+
+
+def get_bulk_stock_info(limiter=None, page_size=BULK_PAGE_SIZE, cache=None, controller=None):
+    """
+    批量模式：分页拉取全部公司的股本数据和公司信息，并按代码合并
+
+    参数:
+        limiter (TokenBucket): 限速器，默认使用全局限速器
+        page_size (int): 每页条数
+        cache (ResponseCache): 响应缓存，批量结果中的 TRADE_DATE 用于使旧缓存失效
+        controller (AdaptiveController): 并发与重试控制器
+
+    返回:
+        dict: 以股票代码为键、与 get_stock_info 结果格式相同的字典；拉取失败时为空
+    """
+    return QueryScheduler(QUERY_SPECS, limiter, cache, controller, page_size).fetch_bulk()
+
+
+class StockIndex:
+    """
+    每只股票最近一次获取结果的持久化索引（SQLite），记录 TRADE_DATE、股本数值和检查时间，
+    供增量模式判断哪些代码需要重新获取
+
+    参数:
+        path (str): 索引文件路径
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_index (
+                code TEXT PRIMARY KEY,
+                trade_date TEXT NOT NULL,
+                total_domestic TEXT NOT NULL,
+                total_unlimit TEXT NOT NULL,
+                info TEXT NOT NULL,
+                checked REAL NOT NULL
+            )""")
+        self.conn.commit()
+
+    def get(self, code, max_age=None):
+        """返回索引中的结果，没有记录或超过 max_age 秒未检查时返回None"""
+        with self.lock:
+            row = self.conn.execute("SELECT info, checked FROM stock_index WHERE code = ?", (code,)).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return json.loads(row[0])
+
+    def update(self, code, info):
+        """写入一只股票的最新结果"""
+        self.update_many([(code, info)])
+
+    def update_many(self, items):
+        """在一个事务中写入多只股票的最新结果，items 为 (代码, 结果) 序列"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO stock_index VALUES (?, ?, ?, ?, ?, ?)",
+                [(code, str(info.get("TRADE_DATE", "")), str(info.get("TOTAL_DOMESTIC_VOL", "")),
+                  str(info.get("TOTAL_UNLIMIT_VOL", "")), json.dumps(info, ensure_ascii=False), now)
+                 for code, info in items])
+            self.conn.commit()
+
+    def is_changed(self, code, info):
+        """判断新结果与索引中记录的交易日和股本数值是否不同，索引中没有的代码视为已变化"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT trade_date, total_domestic, total_unlimit FROM stock_index WHERE code = ?",
+                (code,)).fetchone()
+        return row is None or row != (str(info.get("TRADE_DATE", "")), str(info.get("TOTAL_DOMESTIC_VOL", "")),
+                                      str(info.get("TOTAL_UNLIMIT_VOL", "")))
+
+    def sample(self, n):
+        """随机抽取最多n个已索引的代码"""
+        with self.lock:
+            codes = [row[0] for row in self.conn.execute("SELECT code FROM stock_index")]
+        return random.sample(codes, min(n, len(codes)))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
 
-            # 将数值乘以10000并转换为整数（去掉小数点）
-            try:
-                if total_domestic != "N/A":
-                    total_domestic = str(int(float(total_domestic) * 10000))
-                if total_unlimit != "N/A":
-                    total_unlimit = str(int(float(total_unlimit) * 10000))
-            except (ValueError, TypeError):
-                pass
-
-            result.update({
-                "TOTAL_DOMESTIC_VOL": total_domestic,
-                "TOTAL_UNLIMIT_VOL": total_unlimit,
-                "TRADE_DATE": vol_result.get("TRADE_DATE", "N/A")
-            })
-
-        # 处理公司信息
-        if company_data.get("result") and len(company_data["result"]) > 0:
-            comp_result = company_data["result"][0]
-            result.update({
-                "FULL_NAME": comp_result.get("FULL_NAME", "N/A"),
-            })
-
-        return result
 
+class HistoryStore:
+    """
+    历史股本数据库（SQLite），每次获取的结果按 (A股代码, TRADE_DATE) 追加保存，
+    同一代码同一交易日重复获取时以最新一次为准
+
+    主键 (code, trade_date) 用于单只股票的时间序列查询，
+    (trade_date, code) 索引用于某一交易日的横截面查询。
+
+    参数:
+        path (str): 数据库文件路径
+    """
+
+    COLUMNS = ("code", "trade_date", "total_domestic", "total_unlimit", "full_name", "fetched")
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+                code TEXT NOT NULL,
+                trade_date TEXT NOT NULL,
+                total_domestic INTEGER,
+                total_unlimit INTEGER,
+                full_name TEXT,
+                fetched REAL NOT NULL,
+                PRIMARY KEY (code, trade_date)
+            ) WITHOUT ROWID""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_history_date ON history (trade_date, code)")
+        self.conn.commit()
+
+    @staticmethod
+    def _to_int(value):
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            return None
+
+    def append(self, code, info):
+        """保存一次获取结果，没有 TRADE_DATE 的结果不保存"""
+        trade_date = info.get("TRADE_DATE")
+        if not trade_date or trade_date == "N/A":
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?)",
+                (code, str(trade_date), self._to_int(info.get("TOTAL_DOMESTIC_VOL")),
+                 self._to_int(info.get("TOTAL_UNLIMIT_VOL")), info.get("FULL_NAME"), time.time()))
+            self.conn.commit()
+
+    def append_table(self, table):
+        """
+        批量保存 build_table 得到的列式结果，用于全市场刷新和历史回填
+
+        参数:
+            table (DataFrame): 以代码为索引，包含 TRADE_DATE、TOTAL_DOMESTIC_VOL、TOTAL_UNLIMIT_VOL 等列
+        """
+        table = table[table["TRADE_DATE"].notna()]
+        now = time.time()
+        columns = [table.index.astype(str), table["TRADE_DATE"].astype(str)]
+        for field in ("TOTAL_DOMESTIC_VOL", "TOTAL_UNLIMIT_VOL", "FULL_NAME"):
+            column = table[field] if field in table else pd.Series(pd.NA, index=table.index)
+            columns.append(column.astype(object).where(column.notna(), None))
+        rows = [(code, trade_date, None if domestic is None else int(domestic),
+                 None if unlimit is None else int(unlimit), full_name, now)
+                for code, trade_date, domestic, unlimit, full_name in zip(*columns)]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def as_of(self, trade_date):
+        """
+        查询截至某个交易日所有股票的股本数据
+
+        参数:
+            trade_date (str): 交易日，格式与 TRADE_DATE 相同，如"20240630"
+
+        返回:
+            list: 每只股票在该日及之前最近一条记录，按代码排序
+        """
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT h.* FROM history h
+                JOIN (SELECT code, MAX(trade_date) AS trade_date FROM history
+                      WHERE trade_date <= ? GROUP BY code) latest
+                ON h.code = latest.code AND h.trade_date = latest.trade_date
+                ORDER BY h.code""", (str(trade_date),)).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def history(self, code):
+        """
+        查询某只股票的全部历史记录
+
+        参数:
+            code (str): 股票代码，如"600000"
+
+        返回:
+            list: 按交易日升序排列的记录
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM history WHERE code = ? ORDER BY trade_date",
+                                     (str(code),)).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def find_changed_codes(index, scheduler, sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    找出自上次获取以来股本数据发生变化的代码
+
+    优先用分页批量查询作为变更数据源，逐个对比交易日和股本数值；批量查询失败时
+    随机抽样若干代码重新获取，抽样中只要有一只变化就认为索引已过时。
+    变化的代码接下来要重新获取，它们在响应缓存中的股本数据已经过时，一并删除。
+
+    参数:
+        index (StockIndex): 股票状态索引
+        scheduler (QueryScheduler): 查询调度器
+        sample_size (int): 抽样检查的代码数
+
+    返回:
+        set: 发生变化的代码；为None时表示无法判断，需要全部重新获取
+    """
+    volume_spec = get_spec(scheduler.specs, "volume")
+    cache = scheduler.cache
+    try:
+        records = scheduler.query_all_pages(volume_spec)
+        changed = {code for code, vol_result in records.items()
+                   if index.is_changed(code, extract_fields(volume_spec, vol_result))}
+        if cache is not None:
+            cache.observe_trade_date(max((str(item.get("TRADE_DATE") or "") for item in records.values()),
+                                         default=""))
+            cache.discard(cache_dataset(volume_spec["sql_id"], volume_spec.get("params")), changed)
+        return changed
     except Exception as e:
-        print(f"获取股票 {stock_code} 数据时出错: {str(e)}")
-        return {"error": str(e)}
+        print(f"获取变更数据时出错，改为抽样检查: {str(e)}")
 
+    # 抽样检查不走缓存，必须拿到最新数据
+    uncached = QueryScheduler(scheduler.specs, scheduler.limiter, None, scheduler.controller,
+                              metrics=scheduler.metrics)
+    for code in index.sample(sample_size):
+        stock_info = uncached.fetch_code(code)
+        if "error" in stock_info or index.is_changed(code, stock_info):
+            if cache is not None:
+                cache.discard(cache_dataset(volume_spec["sql_id"], volume_spec.get("params")))
+            return None
+    return set()
 
-def process_csv(input_file):
+
+class ProgressJournal:
     """
-    处理CSV文件，更新股本数据
+    追加写入的进度日志，每获取到一只股票的结果就写入一行JSON，用于中断后续传
 
     参数:
-        input_file (str): 输入CSV文件路径
+        path (str): 日志文件路径
+        resume (bool): 为True时读入已有日志并在其后追加，否则清空重新开始
     """
-    # 读取CSV文件
-    with open(input_file, 'r', encoding='gbk') as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
-        fieldnames = reader.fieldnames
 
-    # 处理每一行数据
-    for row in tqdm(rows, desc="正在处理股票数据"):
-        stock_code = row['A股代码']
-        stock_info = get_stock_info(stock_code)
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = self.load(path) if resume else {}
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        # 上次中断时最后一行可能只写了一半，补一个换行避免和新记录连在一起
+        if self.file.tell() > 0:
+            self.file.write("\n")
+
+    @staticmethod
+    def load(path):
+        """读取日志，返回 {股票代码: 结果}，损坏的行直接跳过"""
+        done = {}
+        if not os.path.exists(path):
+            return done
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    done[entry["code"]] = entry["info"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return done
+
+    def record(self, code, info):
+        """记录一只股票的结果并立即刷新到磁盘"""
+        line = json.dumps({"code": code, "info": info}, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def remove(self):
+        """处理全部完成后删除日志"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
-        if "error" not in stock_info:
-            # 更新总股本和流通股数据
-            row['总股本'] = stock_info.get("TOTAL_DOMESTIC_VOL", row['总股本'])
-            row['流通股'] = stock_info.get("TOTAL_UNLIMIT_VOL", row['流通股'])
 
-    # 写回CSV文件
-    with open(input_file, 'w', encoding='gbk', newline='') as f:
+def create_temp_file(output_file):
+    """
+    在输出文件所在目录新建临时文件，返回 (文件描述符, 路径)
+
+    不用 mkstemp：它总是以0600权限创建，替换后原文件的权限就丢了。这里按普通新建文件的权限
+    （受 umask 限制）创建，原文件已存在时再复制它的权限。
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    suffix = os.path.splitext(output_file)[1]
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    while True:
+        temp_path = os.path.join(output_dir, f".tmp_{os.urandom(6).hex()}{suffix}")
+        try:
+            fd = os.open(temp_path, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+    if os.path.exists(output_file):
+        shutil.copymode(output_file, temp_path)
+    return fd, temp_path
+
+
+@contextmanager
+def atomic_open(output_file, encoding='gbk'):
+    """先写入同目录下的临时文件，成功后再重命名覆盖，保证原文件不会只写了一半"""
+    fd, temp_path = create_temp_file(output_file)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, newline='') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, output_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_csv_atomic(output_file, fieldnames, rows):
+    """原子地写出整个CSV文件"""
+    with atomic_open(output_file) as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(rows)
 
 
+def fetch_rows(rows, fetch, executor, window, memo_size=DEDUP_MEMO_SIZE):
+    """
+    把每行的代码提交给线程池获取，按输入顺序产出 (row, stock_info)
+
+    最多同时有 window 行在途，输入可以是任意迭代器，内存占用与输入大小无关。
+    重复出现的代码只获取一次，结果分发给所有相同代码的行；
+    最多记住最近 memo_size 个代码，超出时淘汰最久未出现的。
+    """
+    pending = deque()
+    futures = OrderedDict()
+    for row in rows:
+        code = row['A股代码']
+        future = futures.get(code)
+        if future is None:
+            future = futures[code] = executor.submit(fetch, code)
+            if len(futures) > memo_size:
+                futures.popitem(last=False)
+        else:
+            futures.move_to_end(code)
+        pending.append((row, future))
+        if len(pending) >= window:
+            row, future = pending.popleft()
+            yield row, future.result()
+    while pending:
+        row, future = pending.popleft()
+        yield row, future.result()
+
+
+def update_row(row, stock_info, specs=None):
+    """按查询配置中的 columns 用获取到的结果更新一行数据，出错的结果保留原值"""
+    if "error" not in stock_info:
+        # 更新总股本、流通股等配置的列
+        for spec in specs or QUERY_SPECS:
+            for column, field in spec["columns"].items():
+                row[column] = stock_info.get(field, row.get(column, ""))
+    return row
+
+
+def output_fieldnames(fieldnames, specs=None):
+    """在原表头后追加查询配置中CSV没有的列"""
+    fieldnames = list(fieldnames)
+    for spec in specs or QUERY_SPECS:
+        for column in spec["columns"]:
+            if column not in fieldnames:
+                fieldnames.append(column)
+    return fieldnames
+
+
+def shard_rows(rows, shard):
+    """按行号取模筛选属于某个分片的行，shard 为 (序号, 分片数)，为None时返回全部行"""
+    if shard is None:
+        return rows
+    shard_index, shard_count = shard
+    return (row for line_no, row in enumerate(rows) if line_no % shard_count == shard_index)
+
+
+def parse_shard(value):
+    """解析 "i/N" 格式的分片参数，i 从0开始"""
+    try:
+        shard_index, shard_count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N: {value}")
+    if not 0 <= shard_index < shard_count:
+        raise argparse.ArgumentTypeError(f"分片序号应在 0 到 {shard_count - 1} 之间: {value}")
+    return shard_index, shard_count
+
+
+def shard_output_file(output_file, shard):
+    """分片的默认输出文件名，如 股票列表.csv -> 股票列表.shard-0-of-4.csv"""
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def merge_shards(shard_files, output_file):
+    """
+    按原始行顺序合并各分片的输出，得到与原CSV布局相同的GBK文件
+
+    第 k 行属于第 k % N 个分片，因此依次轮流从各分片读取一行即可还原原顺序。
+
+    参数:
+        shard_files (list): 按分片序号排列的分片输出文件
+        output_file (str): 合并后的输出文件路径
+    """
+    files = [open(shard_file, 'r', encoding='gbk') for shard_file in shard_files]
+    try:
+        readers = [csv.DictReader(f) for f in files]
+        fieldnames = readers[0].fieldnames
+        if any(reader.fieldnames != fieldnames for reader in readers):
+            raise ValueError("各分片的表头不一致，无法合并")
+
+        with atomic_open(output_file) as f_out:
+            writer = csv.DictWriter(f_out, fieldnames=fieldnames)
+            writer.writeheader()
+            line_no = 0
+            while True:
+                row = next(readers[line_no % len(readers)], None)
+                if row is None:
+                    break
+                writer.writerow(row)
+                line_no += 1
+            if any(next(reader, None) is not None for reader in readers):
+                raise ValueError("各分片的行数与轮流分配的结果不符，无法合并")
+    finally:
+        for f in files:
+            f.close()
+
+
+def process_csv(input_file, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, bulk=False, cache=None,
+                resume=False, journal_file=None, stream=False, output_file=None,
+                index=None, delta=False, max_age=DEFAULT_MAX_AGE, history=None, retries=DEFAULT_RETRIES,
+                specs=None, metrics=None, shard=None):
+    """
+    处理CSV文件，更新股本数据
+
+    参数:
+        input_file (str): 输入CSV文件路径
+        workers (int): 并发线程数，为1时逐个请求
+        rate (float): 全局限速，每秒最多请求数
+        bulk (bool): 是否先分页批量拉取全部公司数据，批量结果中缺失的代码再逐个请求
+        cache (ResponseCache): 响应缓存，为None时不使用缓存
+        resume (bool): 是否从进度日志续传，日志中已有结果的代码不再请求
+        journal_file (str): 进度日志路径，默认为输出文件名加 .journal 后缀
+        stream (bool): 流式处理，边读边请求边写入临时文件，内存占用不随文件大小增长
+        output_file (str): 输出CSV文件路径，默认覆盖输入文件
+        index (StockIndex): 股票状态索引，每次成功获取后更新，为None时不记录
+        delta (bool): 增量模式，只重新获取索引中没有、超过 max_age 未检查或已变化的代码
+        max_age (float): 增量模式下索引记录的最长信任时间（秒）
+        history (HistoryStore): 历史股本数据库，每次成功获取后追加，为None时不保存
+        retries (int): 单个请求失败后的最多重试次数
+        specs (list): 查询配置，默认为 QUERY_SPECS
+        metrics (RequestMetrics): 请求统计，为None时不记录
+        shard (tuple): (序号, 分片数)，只处理行号取模等于序号的行，输出文件只包含这些行
+
+    返回:
+        dict: 重试用尽后仍获取失败的 {股票代码: 错误信息}
+    """
+    output_file = output_file or (shard_output_file(input_file, shard) if shard else input_file)
+    desc = f"正在处理股票数据[分片{shard[0]}/{shard[1]}]" if shard else "正在处理股票数据"
+
+    # 多线程并发获取，所有线程共享同一个调度器（限速器、控制器和缓存）；结果按输入顺序写回
+    # 每个线程同时发出各数据集的查询，实际在途请求数由控制器根据延迟和错误自适应调整
+    specs = specs or QUERY_SPECS
+    workers = max(1, workers)
+    limiter = TokenBucket(rate)
+    controller = AdaptiveController(max_concurrency=workers * len(specs), max_retries=retries)
+    scheduler = QueryScheduler(specs, limiter, cache, controller, metrics=metrics)
+    failed = {}
+    journal = ProgressJournal(journal_file or output_file + ".journal", resume=resume)
+    if resume:
+        print(f"从进度日志恢复 {len(journal.done)} 条结果")
+    # 批量模式的结果本身带有最新交易日，其他情况先查一次，避免使用旧交易日的缓存
+    if bulk:
+        bulk_results = scheduler.fetch_bulk()
+    else:
+        bulk_results = {}
+        scheduler.refresh_trade_date()
+
+    changed = None
+    if delta and index is not None:
+        changed = find_changed_codes(index, scheduler)
+        if changed is None:
+            print("抽样检查发现变化，全部重新获取")
+        else:
+            print(f"变更数据中共有 {len(changed)} 只股票新增或发生变化")
+
+    def fetch(code):
+        if code in journal.done:
+            return journal.done[code]
+        if changed is not None and code not in changed:
+            stock_info = index.get(code, max_age)
+            if stock_info is not None:
+                return stock_info
+        stock_info = bulk_results.get(code) or scheduler.fetch_code(code)
+        if "error" in stock_info:
+            failed[code] = stock_info["error"]
+        else:
+            journal.record(code, stock_info)
+            if index is not None:
+                index.update(code, stock_info)
+            if history is not None:
+                history.append(code, stock_info)
+        return stock_info
+
+    window = workers * 4
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        if stream:
+            # 流式处理：DictReader -> 线程池 -> DictWriter，写完后原子替换输出文件
+            # 输出文件默认就是输入文件，必须先关闭输入再替换，否则 Windows 上重命名会因文件被占用而失败
+            with atomic_open(output_file) as f_out:
+                with open(input_file, 'r', encoding='gbk') as f_in:
+                    reader = csv.DictReader(f_in)
+                    writer = csv.DictWriter(f_out, fieldnames=output_fieldnames(reader.fieldnames, specs))
+                    writer.writeheader()
+                    results = fetch_rows(shard_rows(reader, shard), fetch, executor, window)
+                    for row, stock_info in tqdm(results, desc=desc):
+                        writer.writerow(update_row(row, stock_info, specs))
+        else:
+            # 读取CSV文件
+            with open(input_file, 'r', encoding='gbk') as f:
+                reader = csv.DictReader(f)
+                rows = list(shard_rows(reader, shard))
+                fieldnames = output_fieldnames(reader.fieldnames, specs)
+
+            results = fetch_rows(rows, fetch, executor, window)
+            for row, stock_info in tqdm(results, total=len(rows), desc=desc):
+                update_row(row, stock_info, specs)
+
+            # 写回CSV文件
+            write_csv_atomic(output_file, fieldnames, rows)
+    except BaseException:
+        # 中断时取消排队中的任务，已完成的结果都在进度日志里，可用 --resume 续传
+        executor.shutdown(wait=True, cancel_futures=True)
+        journal.close()
+        raise
+    executor.shutdown()
+    journal.remove()
+
+    print(controller.summary())
+    if failed:
+        print(f"以下 {len(failed)} 只股票重试后仍获取失败，保留原数据:")
+        for code, error in failed.items():
+            print(f"  {code}: {error}")
+    return failed
+
+
+def process_csv_columnar(input_file, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, cache=None, output_file=None,
+                         history=None, retries=DEFAULT_RETRIES, specs=None, metrics=None, index=None):
+    """
+    列式处理CSV文件：整表读入，批量拉取全部公司的原始数据，
+    缺失的代码逐个补齐后整列转换为 Int64，再按 A股代码 合并并整表写回
+
+    需要安装 numpy 和 pandas。适合大列表和历史回填，内存占用为紧凑的列式数据。
+
+    参数:
+        input_file (str): 输入CSV文件路径
+        workers (int): 逐个补齐缺失代码时的并发线程数
+        rate (float): 全局限速，每秒最多请求数
+        cache (ResponseCache): 响应缓存，为None时不使用缓存
+        output_file (str): 输出CSV文件路径，默认覆盖输入文件
+        history (HistoryStore): 历史股本数据库，为None时不保存
+        retries (int): 单个请求失败后的最多重试次数
+        specs (list): 查询配置，默认为 QUERY_SPECS
+        metrics (RequestMetrics): 请求统计，为None时不记录
+        index (StockIndex): 股票状态索引，写入与逐行处理相同格式的结果，供之后的增量模式使用
+
+    返回:
+        dict: 重试用尽后仍获取失败的 {股票代码: 错误信息}
+    """
+    if pd is None:
+        raise RuntimeError("列式处理需要安装 numpy 和 pandas")
+    output_file = output_file or input_file
+    specs = specs or QUERY_SPECS
+    workers = max(1, workers)
+    limiter = TokenBucket(rate)
+    controller = AdaptiveController(max_concurrency=workers * len(specs), max_retries=retries)
+    scheduler = QueryScheduler(specs, limiter, cache, controller, metrics=metrics)
+
+    # 读取CSV文件，所有列按字符串读入，保持原样写回
+    frame = pd.read_csv(input_file, encoding='gbk', dtype=str, keep_default_na=False)
+    codes = frame['A股代码'].drop_duplicates().tolist()
+
+    raw_results = scheduler.fetch_bulk(transform=False)
+    missing = [code for code in codes if code not in raw_results]
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda code: scheduler.fetch_code(code, transform=False), missing)
+        for code, stock_info in tqdm(zip(missing, results), total=len(missing), desc="正在补齐缺失的股票数据"):
+            if "error" in stock_info:
+                failed[code] = stock_info["error"]
+            else:
+                raw_results[code] = stock_info
+
+    table = build_table({code: raw_results[code] for code in codes if code in raw_results}, specs)
+    joined = table.reindex(frame['A股代码'])
+    for spec in specs:
+        for column, field in spec["columns"].items():
+            if column not in frame:
+                frame[column] = ""
+            values = joined[field]
+            mask = values.notna().to_numpy()
+            frame.loc[mask, column] = values[mask].astype(str).to_numpy()
+
+    if history is not None:
+        history.append_table(table)
+    if index is not None:
+        # 索引中的结果与逐行处理一致，是逐个转换后的字符串
+        index.update_many((code, {field: TRANSFORMS[name](info[field]) if name else info[field]
+                                  for spec in specs for field, name in spec["fields"].items() if field in info})
+                          for code, info in raw_results.items() if code in table.index)
+
+    # 写回CSV文件，换行符与 csv 模块一致
+    with atomic_open(output_file) as f:
+        frame.to_csv(f, index=False, lineterminator="\r\n")
+
+    print(controller.summary())
+    if failed:
+        print(f"以下 {len(failed)} 只股票重试后仍获取失败，保留原数据:")
+        for code, error in failed.items():
+            print(f"  {code}: {error}")
+    return failed
+
+
+def run_job(csv_file, output_file, options, shard=None):
+    """
+    按命令行选项打开缓存、索引、历史库等资源并处理一个CSV（或其中一个分片）
+
+    顶层函数，可以直接提交给进程池；每个进程打开自己的SQLite连接。
+
+    参数:
+        csv_file (str): 输入CSV文件路径
+        output_file (str): 输出CSV文件路径
+        options (dict): 命令行选项（argparse 结果的 vars）
+        shard (tuple): (序号, 分片数)，为None时处理全部行
+
+    返回:
+        dict: 获取失败的 {股票代码: 错误信息}
+    """
+    specs = load_query_specs(options["specs"]) if options["specs"] else QUERY_SPECS
+    cache = None if options["no_cache"] else ResponseCache(options["cache"], ttl=options["cache_ttl"])
+    index = StockIndex(options["index"])
+    history = HistoryStore(options["history"])
+    metrics = RequestMetrics() if options["metrics_json"] or options["metrics_prom"] else None
+    suffix = f".shard-{shard[0]}-of-{shard[1]}" if shard and options["processes"] > 1 else ""
+    try:
+        if options["columnar"]:
+            return process_csv_columnar(csv_file, workers=options["workers"], rate=options["rate"], cache=cache,
+                                        output_file=output_file, history=history, retries=options["retries"],
+                                        specs=specs, metrics=metrics, index=index)
+        return process_csv(csv_file, workers=options["workers"], rate=options["rate"], bulk=options["bulk"],
+                           cache=cache, resume=options["resume"],
+                           journal_file=options["journal"] + suffix if options["journal"] else None,
+                           stream=options["stream"], output_file=output_file, index=index, delta=options["delta"],
+                           max_age=options["max_age"], history=history, retries=options["retries"], specs=specs,
+                           metrics=metrics, shard=shard)
+    finally:
+        if metrics is not None:
+            if options["metrics_json"]:
+                metrics.export_json(options["metrics_json"] + suffix)
+            if options["metrics_prom"]:
+                metrics.export_prometheus(options["metrics_prom"] + suffix)
+        if cache is not None:
+            cache.close()
+        index.close()
+        history.close()
+
+
 if __name__ == "__main__":
-    csv_file = input("请输入CSV文件路径: ")
-    process_csv(csv_file)
-    print("数据处理完成并已更新到原文件")
+    parser = argparse.ArgumentParser(description="从上交所获取股本数据并更新CSV文件")
+    parser.add_argument("csv_file", nargs="?", help="CSV文件路径，不指定且在终端中运行时交互输入")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="并发线程数")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="全局限速（每秒请求数）；--processes 时由各进程平分，--shard 时为每个分片（各自在不同主机上）的限速")
+    parser.add_argument("--bulk", action="store_true", help="分页批量拉取全部公司数据，缺失的代码再逐个请求")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="响应缓存文件路径")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL, help="缓存有效期（秒）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用响应缓存")
+    parser.add_argument("--resume", action="store_true", help="从上次中断处的进度日志续传")
+    parser.add_argument("--journal", help="进度日志路径，默认为输出文件名加 .journal 后缀")
+    parser.add_argument("--stream", action="store_true", help="流式处理，内存占用不随文件大小增长")
+    parser.add_argument("-o", "--output", help="输出CSV文件路径，默认覆盖原文件（--shard 时默认为分片文件）")
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="股票状态索引文件路径")
+    parser.add_argument("--delta", action="store_true", help="增量模式，只重新获取过期或已变化的股票")
+    parser.add_argument("--specs", help="额外查询配置的JSON文件，格式同 QUERY_SPECS")
+    parser.add_argument("--metrics-json", help="把请求统计导出为JSON文件")
+    parser.add_argument("--metrics-prom", help="把请求统计导出为 Prometheus textfile")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="单个请求失败后的最多重试次数")
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE, help="增量模式下索引记录的最长信任时间（秒）")
+    parser.add_argument("--history", default=DEFAULT_HISTORY_FILE, help="历史股本数据库路径")
+    parser.add_argument("--as-of", help="只查询历史数据库：截至该交易日所有股票的股本数据，不发送请求")
+    parser.add_argument("--history-of", help="只查询历史数据库：该股票代码的全部历史记录，不发送请求")
+    parser.add_argument("--columnar", action="store_true",
+                        help="列式处理：批量拉取后整列转换并整表读写（需要 numpy 和 pandas）")
+    parser.add_argument("--shard", type=parse_shard, help="只处理第 i 个分片（共 N 个，i 从0开始），格式 i/N")
+    parser.add_argument("--processes", type=int, default=1, help="在本机用多个进程分片处理，完成后自动合并")
+    parser.add_argument("--merge", nargs="+", metavar="SHARD_FILE",
+                        help="按分片序号顺序给出各分片的输出文件，合并为 -o 指定的文件后退出")
+    args = parser.parse_args()
+    options = vars(args)
+
+    if args.as_of or args.history_of:
+        history = HistoryStore(args.history)
+        records = history.as_of(args.as_of) if args.as_of else history.history(args.history_of)
+        for record in records:
+            print(json.dumps(record, ensure_ascii=False))
+        history.close()
+        raise SystemExit(0)
+
+    if args.merge:
+        if not args.output:
+            parser.error("--merge 需要用 -o 指定合并后的输出文件")
+        merge_shards(args.merge, args.output)
+        print(f"已合并 {len(args.merge)} 个分片到 {args.output}")
+        raise SystemExit(0)
+
+    if args.csv_file:
+        csv_file = args.csv_file
+    elif sys.stdin.isatty():
+        csv_file = input("请输入CSV文件路径: ")
+    else:
+        parser.error("非交互运行时必须指定CSV文件路径")
+
+    if args.columnar and (args.shard or args.processes > 1):
+        parser.error("--columnar 整表处理，不能与 --shard 或 --processes 同时使用")
+    if args.columnar and (args.delta or args.resume or args.stream or args.journal):
+        parser.error("--columnar 总是批量拉取并整表读写，不能与 --delta、--resume、--stream 或 --journal 同时使用")
+    if (args.bulk or args.delta) and args.processes > 1:
+        parser.error("--bulk 和 --delta 会在每个进程中重复分页拉取全部数据，不能与 --processes 同时使用")
+
+    if args.processes > 1:
+        # 本机多进程：每个进程处理一个分片并写入自己的分片文件，全部完成后按原顺序合并
+        output_file = args.output or csv_file
+        shards = [(i, args.processes) for i in range(args.processes)]
+        shard_files = [shard_output_file(output_file, shard) for shard in shards]
+        # 所有进程从同一台主机发出请求，总请求速率仍不能超过 --rate，因此每个进程只用其中一份
+        shard_options = dict(options, rate=args.rate / args.processes)
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            futures = [pool.submit(run_job, csv_file, shard_file, shard_options, shard)
+                       for shard, shard_file in zip(shards, shard_files)]
+            failed = {}
+            for future in futures:
+                failed.update(future.result())
+        merge_shards(shard_files, output_file)
+        for shard_file in shard_files:
+            os.remove(shard_file)
+        print(f"{args.processes} 个分片共有 {len(failed)} 只股票获取失败")
+        print(f"数据处理完成并已更新到 {args.output or '原文件'}")
+    else:
+        output_file = args.output or (shard_output_file(csv_file, args.shard) if args.shard else csv_file)
+        run_job(csv_file, output_file, options, args.shard)
+        print(f"数据处理完成并已更新到 {output_file if args.output or args.shard else '原文件'}")
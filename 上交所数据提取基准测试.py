@@ -0,0 +1,458 @@
+import gc
+import os
+import io
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import multiprocessing
+from decimal import Decimal
+from itertools import cycle, islice
+from contextlib import redirect_stdout, redirect_stderr
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import 上交所公开数据提取 as sse
+
+DEFAULT_CSV_FILE = "上海股票列表 .csv"
+
+
+def synthesize_fixtures(csv_file=DEFAULT_CSV_FILE, trade_date=None):
+    """
+    根据股票列表CSV生成两个sqlId的回放数据，字段格式与上交所接口一致
+
+    参数:
+        csv_file (str): GBK编码的股票列表CSV
+        trade_date (str): 写入 TRADE_DATE 的交易日，默认为今天
+
+    返回:
+        dict: {sqlId: {股票代码: 响应JSON}}
+    """
+    trade_date = trade_date or time.strftime("%Y%m%d")
+    fixtures = {sse.VOLUME_SQL_ID: {}, sse.COMPANY_SQL_ID: {}}
+    with open(csv_file, 'r', encoding='gbk') as f:
+        for row in csv.DictReader(f):
+            code = row['A股代码']
+            fixtures[sse.VOLUME_SQL_ID][code] = {"result": [{
+                "COMPANY_CODE": code,
+                # 接口返回的单位是万股
+                "TOTAL_DOMESTIC_VOL": str(Decimal(row['总股本']) / 10000),
+                "TOTAL_UNLIMIT_VOL": str(Decimal(row['流通股']) / 10000),
+                "TRADE_DATE": trade_date,
+            }]}
+            fixtures[sse.COMPANY_SQL_ID][code] = {"result": [{
+                "COMPANY_CODE": code,
+                "FULL_NAME": row['证券简称'],
+            }]}
+    return fixtures
+
+
+def record_fixtures(codes, output_file, rate=sse.DEFAULT_RATE):
+    """
+    从上交所实际接口录制回放数据
+
+    参数:
+        codes (list): 要录制的股票代码
+        output_file (str): 保存的JSON文件路径
+        rate (float): 录制时的限速（每秒请求数）
+    """
+    limiter = sse.TokenBucket(rate)
+    fixtures = {sse.VOLUME_SQL_ID: {}, sse.COMPANY_SQL_ID: {}}
+    for code in codes:
+        for sql_id in fixtures:
+            params = {
+                "jsonCallBack": "jsonpCallback",
+                "isPagination": "false",
+                "sqlId": sql_id,
+                "COMPANY_CODE": code,
+                "_": str(int(time.time() * 1000))
+            }
+            fixtures[sql_id][code] = sse.query_jsonp(params, limiter)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, ensure_ascii=False)
+
+
+def load_fixtures(fixtures_file):
+    with open(fixtures_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ReplayServer:
+    """
+    本地模拟的 query.sse.com.cn/commonQuery.do，回放录制的JSONP数据
+
+    支持单个代码查询和分页批量查询，可配置延迟、抖动和错误率。
+
+    参数:
+        fixtures (dict): {sqlId: {股票代码: 响应JSON}}
+        latency (float): 每个请求的平均延迟（秒）
+        jitter (float): 延迟的随机抖动幅度（秒）
+        error_rate (float): 返回503的概率
+        host (str): 监听地址
+        port (int): 监听端口，0表示自动分配
+    """
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, host="127.0.0.1", port=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.httpd = None
+        # 分页查询按代码顺序返回每只股票的第一条记录
+        self.records = {sql_id: [data["result"][0] for data in by_code.values() if data.get("result")]
+                        for sql_id, by_code in fixtures.items()}
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/commonQuery.do"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 支持keep-alive，和真实接口一样可以复用连接
+            disable_nagle_algorithm = True  # 避免响应头和响应体分两次发送时的Nagle延迟
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, request):
+        parsed = urlparse(request.path)
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if parsed.path != "/commonQuery.do" or params.get("sqlId") not in self.fixtures:
+            self.send(request, 404, b"Not Found", "text/plain")
+            return
+        if random.random() < self.error_rate:
+            self.send(request, 503, b"Service Unavailable", "text/plain")
+            return
+
+        sql_id = params["sqlId"]
+        if params.get("isPagination") == "true":
+            page_size = int(params.get("pageHelp.pageSize", 25))
+            page_no = int(params.get("pageHelp.pageNo", 1))
+            records = self.records[sql_id]
+            page = records[(page_no - 1) * page_size:page_no * page_size]
+            payload = {"result": page, "pageHelp": {
+                "pageNo": page_no, "pageSize": page_size, "total": len(records),
+                "pageCount": (len(records) + page_size - 1) // page_size, "data": page}}
+        else:
+            payload = self.fixtures[sql_id].get(params.get("COMPANY_CODE", ""), {"result": []})
+
+        callback = params.get("jsonCallBack", "jsonpCallback")
+        body = f"{callback}({json.dumps(payload, ensure_ascii=False)})".encode("utf-8")
+        self.send(request, 200, body, "text/javascript;charset=UTF-8")
+
+    @staticmethod
+    def send(request, status, body, content_type):
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def serve_in_process(fixtures, latency, jitter, error_rate, port_queue):
+    """子进程入口：启动回放服务器并把端口号传回父进程"""
+    server = ReplayServer(fixtures, latency=latency, jitter=jitter, error_rate=error_rate).start()
+    port_queue.put(server.port)
+    while True:
+        time.sleep(3600)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+def bench_once(target, rows, fieldnames, workers, rate, trace_memory=False):
+    """
+    运行一次基准测试
+
+    tracemalloc 会明显拖慢Python代码，因此吞吐量和峰值内存需要分两次运行测量
+
+    参数:
+        target (str): "process_csv" 或 "get_stock_info"
+        rows (list): 输入的CSV行
+        fieldnames (list): CSV表头
+        workers (int): 并发线程数
+        rate (float): 全局限速（每秒请求数）
+        trace_memory (bool): 是否用 tracemalloc 记录峰值内存
+
+    返回:
+        dict: 吞吐量、每只股票延迟的 p50/p99、峰值内存和失败数
+    """
+    latencies = []
+    original = sse.QueryScheduler.fetch_code
+
+    def timed_fetch_code(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = os.path.join(temp_dir, "stocks.csv")
+        sse.write_csv_atomic(input_file, fieldnames, rows)
+
+        sse.QueryScheduler.fetch_code = timed_fetch_code
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            # process_csv 的进度条和统计信息不输出到基准测试结果里
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+                if target == "process_csv":
+                    failed = sse.process_csv(input_file, workers=workers, rate=rate)
+                else:
+                    limiter = sse.TokenBucket(rate)
+                    controller = sse.AdaptiveController(max_concurrency=workers * 2)
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        results = list(executor.map(
+                            lambda row: sse.get_stock_info(row['A股代码'], limiter, controller=controller), rows))
+                    failed = [info for info in results if "error" in info]
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            sse.QueryScheduler.fetch_code = original
+
+    return {
+        "target": target,
+        "size": len(rows),
+        "workers": workers,
+        "codes_per_sec": len(rows) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_mb": peak / 1024 / 1024,
+        "failed": len(failed),
+    }
+
+
+def run_benchmark(fixtures, csv_file=DEFAULT_CSV_FILE, concurrency=(1, 4, 8, 16), sizes=(100, 500),
+                  targets=("process_csv",), latency=0.05, jitter=0.02, error_rate=0.0, rate=1000.0):
+    """
+    在子进程中启动回放服务器（避免和抓取代码争抢GIL），在不同并发数和输入规模下测试抓取吞吐量
+
+    参数:
+        fixtures (dict): 回放数据
+        csv_file (str): 提供输入行的股票列表CSV，规模超过行数时循环使用
+        concurrency (tuple): 要测试的并发线程数
+        sizes (tuple): 要测试的输入行数
+        targets (tuple): 要测试的函数
+        latency (float): 模拟的平均延迟（秒）
+        jitter (float): 模拟的延迟抖动（秒）
+        error_rate (float): 模拟的错误率
+        rate (float): 抓取时的全局限速（每秒请求数）
+
+    返回:
+        list: 每次测试的结果
+    """
+    with open(csv_file, 'r', encoding='gbk') as f:
+        reader = csv.DictReader(f)
+        all_rows = list(reader)
+        fieldnames = reader.fieldnames
+
+    results = []
+    original_url = sse.BASE_URL
+    port_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(target=serve_in_process, daemon=True,
+                                             args=(fixtures, latency, jitter, error_rate, port_queue))
+    server_process.start()
+    sse.BASE_URL = f"http://127.0.0.1:{port_queue.get(timeout=30)}/commonQuery.do"
+    try:
+        for target in targets:
+            for size in sizes:
+                rows = [dict(row) for row in islice(cycle(all_rows), size)]
+                for workers in concurrency:
+                    result = bench_once(target, rows, fieldnames, workers, rate)
+                    result["peak_mb"] = bench_once(target, rows, fieldnames, workers, rate,
+                                                   trace_memory=True)["peak_mb"]
+                    results.append(result)
+                    print(f"{target:<15} {size:>6} {workers:>4} {result['codes_per_sec']:>10.1f} "
+                          f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                          f"{result['peak_mb']:>9.2f} {result['failed']:>5}")
+    finally:
+        sse.BASE_URL = original_url
+        server_process.terminate()
+    return results
+
+
+def synthesize_page(fixtures, sql_id, page_size, callback="jsonpCallback1700000000000", extra_fields=20):
+    """
+    生成一页与上交所接口格式一致的分页JSONP响应体
+
+    真实接口每条记录有几十个字段，pageHelp.data 还会重复一遍 result，这里用 extra_fields 个填充字段模拟
+
+    返回:
+        bytes: 响应体
+    """
+    records = [data["result"][0] for data in fixtures[sql_id].values() if data.get("result")]
+    page = []
+    for item in islice(cycle(records), page_size):
+        item = dict(item)
+        for i in range(extra_fields):
+            item[f"FIELD_{i}"] = f"{random.random():.6f}"
+        page.append(item)
+    payload = {"result": page, "pageHelp": {"pageNo": 1, "pageSize": page_size, "total": page_size,
+                                            "pageCount": 1, "data": page}}
+    return f"{callback}({json.dumps(payload, ensure_ascii=False)})".encode("utf-8")
+
+
+def legacy_decode(content, callback):
+    """原来的解析方式：先解码成str，replace 去掉回调名，strip 去掉括号后用标准库解析"""
+    return json.loads(content.decode("utf-8").replace(callback, "").strip("();"))
+
+
+def run_decode_benchmark(fixtures, page_sizes=(100, 1000, 5000), repeat=20):
+    """
+    解析微基准：比较原来的 replace + json.loads 和切片 + 各JSON后端 + 只保留所需字段
+
+    参数:
+        fixtures (dict): 回放数据
+        page_sizes (tuple): 每页记录数
+        repeat (int): 每种方式重复解析的次数
+
+    返回:
+        list: 每种方式的结果
+    """
+    callback = "jsonpCallback1700000000000"
+    spec = sse.get_spec(sse.QUERY_SPECS, "volume")
+    fields = {"COMPANY_CODE", "TRADE_DATE", *spec["fields"]}
+    methods = {"legacy": lambda content: legacy_decode(content, callback)}
+    for name, loads in sse.JSON_BACKENDS.items():
+        methods[f"slice+{name}"] = lambda content, loads=loads: sse.trim_payload(
+            sse.decode_jsonp(content, loads), fields)
+
+    results = []
+    for page_size in page_sizes:
+        content = synthesize_page(fixtures, spec["sql_id"], page_size, callback)
+        baseline = None
+        for name, decode in methods.items():
+            # 和 timeit 一样关闭GC并取最快的一次，避免大量临时对象触发的回收淹没解析本身的差别
+            timings = []
+            gc.disable()
+            try:
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    decode(content)
+                    timings.append(time.perf_counter() - started)
+            finally:
+                gc.enable()
+            elapsed = min(timings)
+            baseline = baseline or elapsed
+            result = {"method": name, "page_size": page_size, "bytes": len(content), "ms": elapsed * 1000,
+                      "mb_per_sec": len(content) / elapsed / 1024 / 1024, "speedup": baseline / elapsed}
+            results.append(result)
+            print(f"{name:<14} {page_size:>6} {len(content) / 1024:>9.0f} {result['ms']:>9.2f} "
+                  f"{result['mb_per_sec']:>8.1f} {result['speedup']:>6.2f}x")
+    return results
+
+
+def parse_int_list(value):
+    return tuple(int(item) for item in value.split(",") if item)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上交所数据抓取的离线回放服务器和吞吐量基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="运行吞吐量基准测试")
+    bench_parser.add_argument("--fixtures", help="回放数据JSON文件，不指定时根据股票列表CSV生成")
+    bench_parser.add_argument("--csv", default=DEFAULT_CSV_FILE, help="股票列表CSV")
+    bench_parser.add_argument("--concurrency", type=parse_int_list, default=(1, 4, 8, 16), help="并发线程数，逗号分隔")
+    bench_parser.add_argument("--sizes", type=parse_int_list, default=(100, 500), help="输入行数，逗号分隔")
+    bench_parser.add_argument("--targets", default="process_csv,get_stock_info", help="测试的函数，逗号分隔")
+    bench_parser.add_argument("--latency", type=float, default=0.05, help="模拟的平均延迟（秒）")
+    bench_parser.add_argument("--jitter", type=float, default=0.02, help="模拟的延迟抖动（秒）")
+    bench_parser.add_argument("--error-rate", type=float, default=0.0, help="模拟的错误率")
+    bench_parser.add_argument("--rate", type=float, default=1000.0, help="抓取时的全局限速（每秒请求数）")
+    bench_parser.add_argument("--json", help="把结果另存为JSON文件")
+
+    serve_parser = subparsers.add_parser("serve", help="只启动回放服务器")
+    serve_parser.add_argument("--fixtures", help="回放数据JSON文件，不指定时根据股票列表CSV生成")
+    serve_parser.add_argument("--csv", default=DEFAULT_CSV_FILE, help="股票列表CSV")
+    serve_parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="模拟的平均延迟（秒）")
+    serve_parser.add_argument("--jitter", type=float, default=0.0, help="模拟的延迟抖动（秒）")
+    serve_parser.add_argument("--error-rate", type=float, default=0.0, help="模拟的错误率")
+
+    decode_parser = subparsers.add_parser("decode", help="运行JSONP解析微基准")
+    decode_parser.add_argument("--fixtures", help="回放数据JSON文件，不指定时根据股票列表CSV生成")
+    decode_parser.add_argument("--csv", default=DEFAULT_CSV_FILE, help="股票列表CSV")
+    decode_parser.add_argument("--page-sizes", type=parse_int_list, default=(100, 1000, 5000),
+                               help="每页记录数，逗号分隔")
+    decode_parser.add_argument("--repeat", type=int, default=20, help="每种方式重复解析的次数")
+    decode_parser.add_argument("--json", help="把结果另存为JSON文件")
+
+    record_parser = subparsers.add_parser("record", help="从上交所实际接口录制回放数据")
+    record_parser.add_argument("codes", help="股票代码，逗号分隔")
+    record_parser.add_argument("-o", "--output", default="sse_fixtures.json", help="保存的JSON文件路径")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_fixtures([code for code in args.codes.split(",") if code], args.output)
+        print(f"回放数据已保存到 {args.output}")
+    else:
+        fixtures = load_fixtures(args.fixtures) if args.fixtures else synthesize_fixtures(args.csv)
+        if args.command == "serve":
+            server = ReplayServer(fixtures, latency=args.latency, jitter=args.jitter,
+                                  error_rate=args.error_rate, host="0.0.0.0", port=args.port).start()
+            print(f"回放服务器已启动: http://127.0.0.1:{server.port}/commonQuery.do，按 Ctrl-C 停止")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                server.stop()
+        elif args.command == "decode":
+            print(f"{'方式':<12} {'每页条数':>4} {'响应KB':>7} {'耗时(ms)':>8} {'MB/秒':>6} {'加速':>5}")
+            results = run_decode_benchmark(fixtures, args.page_sizes, args.repeat)
+            if args.json:
+                with open(args.json, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, ensure_ascii=False, indent=2)
+        else:
+            print(f"{'函数':<12} {'行数':>5} {'并发':>3} {'代码/秒':>7} {'p50(ms)':>9} {'p99(ms)':>9} "
+                  f"{'峰值内存MB':>6} {'失败':>3}")
+            results = run_benchmark(fixtures, args.csv, args.concurrency, args.sizes,
+                                    tuple(target for target in args.targets.split(",") if target),
+                                    args.latency, args.jitter, args.error_rate, args.rate)
+            if args.json:
+                with open(args.json, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, ensure_ascii=False, indent=2)